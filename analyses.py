@@ -1,214 +1,380 @@
 """Basic units of analysis; methods to query database and return usable data sets."""
-from datetime import datetime
 # from monthdelta import monthdelta
+import json
 import sqlite3
-import loader
+import db
+import eventselector
+import instrument
 
+CATEGORIES = ('All', 'Nonmembers', 'Members', 'Volunteers', 'Board')
+EVENT_CHUNK = 400  # events per batched query; keeps us under SQLite's 999 host parameter limit
 
-def get_arrival_deltas(events_list):
-    """Return a list of arrival times (as deltas vs start time).
+# Memoized selections, valid only while their generation is the current one (see loader.GENERATION_BUMP)
+MEMO_LOOKUP = ("SELECT m.snapshot FROM memo m JOIN meta g ON g.key = 'generation' " +
+               'WHERE m.key = ? AND m.generation = g.value')
+MEMO_STORE = 'INSERT OR REPLACE INTO memo VALUES (?,?,?)'
+MEMO_EVICT = 'DELETE FROM memo WHERE generation < ?'
+MEMO_TIMEOUT = 100  # ms to wait for ingest to release the database before giving up on storing
+
+
+def classify(is_member, is_volunteer, is_board):
+    """Return the attendee category for a student's group flags."""
+    if is_board:
+        return 'Board'
+    elif is_volunteer:
+        return 'Volunteers'
+    elif is_member:
+        return 'Members'
+    return 'Nonmembers'
 
-    event_query should return a full tuple from events of format (name, time)
+
+def event_chunks(events_list):
+    """Yield (values_clause, params) pairs matching the (name, time) keys of events_list.
+
+    Events are split into chunks of EVENT_CHUNK, each matched by a single IN (VALUES ...) clause.
+    events_list may also be an eventselector.Selection, matched whole by a single subquery.
     """
-    conn = sqlite3.connect(loader.DB)
-    cur = conn.cursor()
+    if isinstance(events_list, eventselector.Selection):
+        yield ('(SELECT name, time FROM events WHERE ' + events_list.where + ')',
+               list(events_list.params))
+        return
 
-    arrival_times = []
-    for event in events_list:
-        cur.execute('SELECT checkin_time FROM records WHERE event_name=? AND event_time=?',
-                    list(event))
-        checkins = [t[0] for t in cur.fetchall() if t[0] != 'Manual']
+    events_list = list(events_list)
+    for i in range(0, len(events_list), EVENT_CHUNK):
+        chunk = events_list[i:i + EVENT_CHUNK]
+        yield ('(VALUES ' + ','.join(['(?,?)'] * len(chunk)) + ')',
+               [field for event in chunk for field in event[:2]])
 
-        for checkin in checkins:
-            arrival_datetime = datetime.strptime(checkin, '%Y-%m-%dT%H:%M:%S')
-            event_datetime = datetime.strptime(event[1], '%Y-%m-%dT%H:%M:%S')
-            arrival_delta = arrival_datetime - event_datetime
-            arrival_times.append(arrival_delta.total_seconds() / 60)
 
-    conn.close()
-    return arrival_times
+@instrument.traced
+def fetch_students(cur, events_list):
+    """Return a dictionary mapping every distinct attendee of events_list to their category.
 
+    Records are pulled already joined to students, one query per EVENT_CHUNK events.
+    """
+    students = {}
+    for values, params in event_chunks(events_list):
+        cur.execute('SELECT DISTINCT r.student_email, s.is_member, s.is_volunteer, s.is_board ' +
+                    'FROM records r JOIN students s ON s.email = r.student_email ' +
+                    'WHERE (r.event_name, r.event_time) IN ' + values,
+                    params)
+        for email, is_member, is_volunteer, is_board in cur:
+            students[email] = classify(is_member, is_volunteer, is_board)
+    return students
+
+
+@instrument.traced
+def fetch_rollup(cur, events_list):
+    """Return a dictionary mapping each event of events_list to its attendee counts per category.
+
+    Counts are read from the rollup table maintained by loader, one row per event.
+    """
+    event_counts = {}
+    for values, params in event_chunks(events_list):
+        cur.execute('SELECT event_name, event_time, board, volunteers, members, nonmembers ' +
+                    'FROM rollup WHERE (event_name, event_time) IN ' + values,
+                    params)
+        for name, time, board, volunteers, members, nonmembers in cur:
+            event_counts[(name, time)] = {'All': board + volunteers + members + nonmembers,
+                                          'Nonmembers': nonmembers,
+                                          'Members': members,
+                                          'Volunteers': volunteers,
+                                          'Board': board}
+    return event_counts
+
+
+@instrument.traced
+def fetch_arrival_deltas(cur, events_list):
+    """Return the arrival deltas of the events in events_list as a NumPy array of minutes.
+
+    Deltas are expanded from the arrival_rollup histogram maintained by loader;
+    manual check-ins are left out.
+    """
+    import numpy as np  # only needed here; keeps importing analyses cheap
+    deltas = [np.empty(0)]
+    attendees = [np.empty(0, dtype=int)]
+    for values, params in event_chunks(events_list):
+        cur.execute('SELECT delta, attendees FROM arrival_rollup ' +
+                    'WHERE (event_name, event_time) IN ' + values,
+                    params)
+        histogram = cur.fetchall()
+        deltas.append(np.fromiter((row[0] for row in histogram), dtype=float, count=len(histogram)))
+        attendees.append(np.fromiter((row[1] for row in histogram), dtype=int, count=len(histogram)))
+    return np.repeat(np.concatenate(deltas), np.concatenate(attendees))
+
+
+def tally(categories):
+    """Count an iterable of attendee categories into a CATEGORIES-keyed dictionary."""
+    counts = dict.fromkeys(CATEGORIES, 0)
+    for category in categories:
+        counts['All'] += 1
+        counts[category] += 1
+    return counts
+
+
+def total_counts(event_counts, average_over=None):
+    """Sum per-event attendee counts, dividing each total by average_over if given.
+
+    Averages over no events are 0.
+    """
+    attendee_counts = dict.fromkeys(CATEGORIES, 0)
+    for counts in event_counts:
+        for field in attendee_counts:
+            attendee_counts[field] += counts[field]
+
+    if average_over is not None:
+        for field in attendee_counts:
+            attendee_counts[field] = attendee_counts[field] / average_over if average_over else 0
+
+    return attendee_counts
 
-def count_attendees(events_list,
-                    distinct_only=False,  # return the number of distinct attendees
-                    average_attendance=False,  # return avg number of attendees
-                    average_events=False):  # return avg number of events attended
-    """Return a list of dictionaries of arrival times."""
-    conn = sqlite3.connect(loader.DB)
-    cur = conn.cursor()
 
+def check_options(distinct_only, average_attendance, average_events):
+    """Raise ValueError if more than one counting mode is selected."""
     if ((distinct_only and (average_attendance or average_events)) or
             (average_attendance and average_events)):
         raise ValueError('Incompatible options selected')
 
-    if average_events:
-        attendee_distinct = count_attendees(events_list, distinct_only=True)
 
-    attendee_counts = {'All': 0,
-                       'Nonmembers': 0,
-                       'Members': 0,
-                       'Volunteers': 0,
-                       'Board': 0}
+class Attendance(object):
+    """Snapshot of the attendance of one group of events.
 
-    attendees = []
+    Per-event counts and arrival times are read from the rollup tables, and the distinct
+    attendees from records, once, on construction; every count, email list, arrival delta
+    and per-event breakdown of the group is then derived in memory.
+    """
+
+    def __init__(self, events_list, cur=None, selection=None):
+        """Fetch the attendance of events_list, using cur if given or a pooled connection otherwise.
 
-    for event in events_list:
-        cur.execute('SELECT student_email FROM records ' +
-                    'WHERE event_name=? AND event_time=?',
-                    list(event))
-        attendees += cur.fetchall()
+        If events_list came from an eventselector.Selection, passing it lets every query match
+        the events through it rather than by their keys.
+        """
+        self.events = [tuple(event[:2]) for event in events_list]
+        self.selection = selection
 
-    if distinct_only:
-        attendees = list(set(attendees))
+        if cur is None:
+            with db.connection() as conn:
+                self.fetch(conn.cursor())
+        else:
+            self.fetch(cur)
+
+    @instrument.traced
+    def fetch(self, cur):
+        """Read the rollups, distinct attendees and arrival deltas of the events through cur."""
+        events = self.events if self.selection is None else self.selection
+        self.rollup = fetch_rollup(cur, events)
+        # distinct attendees, mapped to their category
+        self.students = fetch_students(cur, events)
+        self.arrivals = fetch_arrival_deltas(cur, events)
+
+    def counts(self, distinct_only=False, average_attendance=False, average_events=False):
+        """Return a dictionary of attendee counts per category; see count_attendees.
+
+        Averages are 0 for categories without attendees.
+        """
+        check_options(distinct_only, average_attendance, average_events)
+
+        attendee_distinct = tally(self.students.values())
+        if distinct_only:
+            return attendee_distinct
+
+        attendee_counts = total_counts(self.rollup.values(),
+                                       len(self.events) if average_attendance else None)
+
+        if average_events:
+            for field in attendee_counts:
+                attendee_counts[field] = (attendee_counts[field] / attendee_distinct[field]
+                                          if attendee_distinct[field] else 0)
+
+        return attendee_counts
+
+    def event_counts(self):
+        """Return a list of (event, counts) pairs, one per event of the snapshot."""
+        return [(event, self.rollup.get(event, dict.fromkeys(CATEGORIES, 0))) for event in self.events]
+
+    def emails(self):
+        """Return a dictionary of lists of distinct attendee emails per category."""
+        email_lists = {category: [] for category in CATEGORIES}
+        for email, category in self.students.items():
+            email_lists['All'].append(email)
+            email_lists[category].append(email)
+        return email_lists
+
+    def arrival_deltas(self):
+        """Return a NumPy array of arrival times, in minutes relative to the event start time."""
+        return self.arrivals
+
+    def dump(self):
+        """Serialize the snapshot to JSON, for the memo table."""
+        import numpy as np
+        deltas, attendees = np.unique(self.arrivals, return_counts=True)
+        return json.dumps({
+            'events': self.events,
+            'rollup': [[name, time, counts] for (name, time), counts in self.rollup.items()],
+            'students': self.students,
+            'arrivals': [deltas.tolist(), attendees.tolist()],
+        })
+
+    @classmethod
+    def load(cls, text):
+        """Rebuild a snapshot serialized by dump, without touching the database."""
+        import numpy as np
+        state = json.loads(text)
+        attendance = cls.__new__(cls)
+        attendance.events = [tuple(event) for event in state['events']]
+        attendance.selection = None
+        attendance.rollup = {(name, time): counts for name, time, counts in state['rollup']}
+        attendance.students = state['students']
+        deltas, attendees = state['arrivals']
+        attendance.arrivals = np.repeat(np.array(deltas, dtype=float), np.array(attendees, dtype=int))
+        return attendance
+
+
+def snapshot(events):
+    """Return events as an Attendance snapshot, building one if given an events list."""
+    if isinstance(events, Attendance):
+        return events
+    return Attendance(events)
+
+
+def memo_key(names=[], dates=[], date_range=()):
+    """Return the memo key of a selection, the same however its names and dates are ordered."""
+    return json.dumps([sorted(set(names)),
+                       sorted(set(date.date().isoformat() for date in dates)),
+                       [day.date().isoformat() for day in date_range]])
+
+
+@instrument.traced
+def select(cur, names=[], dates=[], date_range=()):
+    """Return the events list and Attendance snapshot of a selection, memoized across runs.
+
+    Snapshots are kept in the memo table, tagged with the data generation they were computed
+    at; loader moves to a new generation whenever the data changes, so stale ones are ignored.
+    """
+    selection = eventselector.compile_selection(names, dates, date_range)
+    key = memo_key(names, dates, date_range)
+    cur.execute(MEMO_LOOKUP, [key])
+    row = cur.fetchone()
+    if row is not None:
+        attendance = Attendance.load(row[0])
+        return attendance.events, attendance
+
+    # read first: data changing from here on leaves the snapshot under a generation already gone
+    generation = cur.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+    cur.execute('SELECT name, time FROM events WHERE ' + selection.where, selection.params)
+    events_list = cur.fetchall()
+    attendance = Attendance(events_list, cur, selection)
+    store_memo(key, generation, attendance.dump())
+    return events_list, attendance
+
+
+@instrument.traced
+def store_memo(key, generation, snapshot):
+    """Store a serialized snapshot in the memo table, unless the database is busy or read-only.
+
+    The write goes through db's writable pool, since report connections are read-only.
+    """
+    with db.connection(readonly=False) as conn:
+        conn.execute('PRAGMA busy_timeout = %d' % MEMO_TIMEOUT)
+        try:
+            with conn:
+                conn.execute(MEMO_EVICT, [generation])
+                conn.execute(MEMO_STORE, [key, generation, snapshot])
+        except sqlite3.OperationalError:
+            pass  # a later run will store it
+        finally:
+            conn.execute('PRAGMA busy_timeout = %d' % (db.TIMEOUT * 1000))
+
+
+@instrument.traced
+def get_arrival_deltas(events_list):
+    """Return a NumPy array of arrival times (as deltas vs start time, in minutes).
 
-    for attendee in attendees:
-        cur.execute('SELECT is_member,is_volunteer,is_board FROM students WHERE email=?',
-                    attendee)
-        attendee_group = cur.fetchone()
+    events_list may be an Attendance snapshot, or a list of full tuples from events of format (name, time)
+    """
+    if isinstance(events_list, Attendance):
+        return events_list.arrival_deltas()
 
-        attendee_counts['All'] += 1
+    with db.connection() as conn:
+        return fetch_arrival_deltas(conn.cursor(), events_list)
 
-        if attendee_group[2]:
-            attendee_counts['Board'] += 1
-        elif attendee_group[1]:
-            attendee_counts['Volunteers'] += 1
-        elif attendee_group[0]:
-            attendee_counts['Members'] += 1
-        else:
-            attendee_counts['Nonmembers'] += 1
 
-    if average_attendance:
-        for field in attendee_counts:
-            attendee_counts[field] = attendee_counts[field] / len(events_list)
+@instrument.traced
+def count_attendees(events_list,
+                    distinct_only=False,  # return the number of distinct attendees
+                    average_attendance=False,  # return avg number of attendees
+                    average_events=False):  # return avg number of events attended
+    """Return a dictionary of attendee counts per category.
 
-    if average_events:
-        for field in attendee_counts:
-            attendee_counts[field] = attendee_counts[field] / attendee_distinct[field]
+    Total and average attendance are served from the rollup table alone.
+    """
+    if isinstance(events_list, Attendance) or distinct_only or average_events:
+        return snapshot(events_list).counts(distinct_only, average_attendance, average_events)
 
-    conn.close()
-    return attendee_counts
+    check_options(distinct_only, average_attendance, average_events)
+    with db.connection() as conn:
+        event_counts = fetch_rollup(conn.cursor(), events_list)
+    return total_counts(event_counts.values(), len(events_list) if average_attendance else None)
 
 
+@instrument.traced
 def list_emails(events_list):
-    """Return a list of dictionaries of arrival times."""
-    conn = sqlite3.connect(loader.DB)
-    cur = conn.cursor()
-
-    email_lists = {'All': [],
-                   'Nonmembers': [],
-                   'Members': [],
-                   'Volunteers': [],
-                   'Board': []}
-
-    for event in events_list:
-        cur.execute('SELECT student_email FROM records ' +
-                    'WHERE event_name=? AND event_time=?',
-                    list(event))
-        email_lists['All'] += cur.fetchall()
-
-    email_lists['All'] = list(set(email_lists['All']))  # ensure all elements of attendees are distinct
-
-    for attendee in email_lists['All'][0]:
-        cur.execute('SELECT is_member,is_volunteer,is_board FROM students WHERE email=?', [attendee])
-        attendee_group = cur.fetchone()
-
-        if attendee_group[2]:
-            email_lists['Board'].append(attendee)
-        elif attendee_group[1]:
-            email_lists['Volunteers'].append(attendee)
-        elif attendee_group[0]:
-            email_lists['Members'].append(attendee)
-        else:
-            email_lists['Nonmembers'].append(attendee)
+    """Return a dictionary of lists of distinct attendee emails per category."""
+    return snapshot(events_list).emails()
+
 
-    conn.close()
-    return email_lists
+@instrument.traced
+def venn_partitions(*groups):
+    """Partition the distinct attendees of any number of event groups into Venn regions.
 
+    Each group may be an events list or an Attendance snapshot. Returns a dictionary
+    mapping a membership bitmask (bit i set when the attendee came to group i) to a
+    dictionary of email lists per category; regions nobody falls into are absent.
+    Runs in time linear in the number of distinct attendees.
+    """
+    snapshots = [snapshot(group) for group in groups]
+
+    membership = {}
+    categories = {}
+    for i, attendance in enumerate(snapshots):
+        categories.update(attendance.students)
+        for email in attendance.students:
+            membership[email] = membership.get(email, 0) | (1 << i)
+
+    partitions = {}
+    for email, mask in membership.items():
+        if mask not in partitions:
+            partitions[mask] = {category: [] for category in CATEGORIES}
+        partitions[mask]['All'].append(email)
+        partitions[mask][categories[email]].append(email)
 
+    return partitions
+
+
+@instrument.traced
 def compare_attendees(events_list_a, events_list_b):
-    """Compute and return statistics about event attendance."""
-    conn = sqlite3.connect(loader.DB)
-    cur = conn.cursor()
-
-    attendees_a = {'All': [],
-                   'Nonmembers': [],
-                   'Members': [],
-                   'Volunteers': [],
-                   'Board': []}
-
-    for event in events_list_a:
-        cur.execute('SELECT student_email FROM records ' +
-                    'WHERE event_name=? AND event_time=?',
-                    list(event))
-        attendees_a['All'] += cur.fetchall()
-
-    attendees_a['All'] = list(set(attendees_a['All']))
-    attendees_a['All'] = [attendee[0] for attendee in attendees_a['All']]
-    for attendee in attendees_a['All']:
-        cur.execute('SELECT is_member,is_volunteer,is_board FROM students WHERE email=?', [attendee])
-        attendee_group = cur.fetchone()
-
-        if attendee_group[2]:
-            attendees_a['Board'].append(attendee)
-        elif attendee_group[1]:
-            attendees_a['Volunteers'].append(attendee)
-        elif attendee_group[0]:
-            attendees_a['Members'].append(attendee)
-        else:
-            attendees_a['Nonmembers'].append(attendee)
-
-    attendees_b = {'All': [],
-                   'Nonmembers': [],
-                   'Members': [],
-                   'Volunteers': [],
-                   'Board': []}
-
-    for event in events_list_b:
-        cur.execute('SELECT student_email FROM records ' +
-                    'WHERE event_name=? AND event_time=?',
-                    list(event))
-        attendees_b['All'] += cur.fetchall()
-
-    attendees_b['All'] = list(set(attendees_b['All']))
-    attendees_b['All'] = [attendee[0] for attendee in attendees_b['All']]
-    for attendee in attendees_b['All']:
-        cur.execute('SELECT is_member,is_volunteer,is_board FROM students WHERE email=?', [attendee])
-        attendee_group = cur.fetchone()
-
-        if attendee_group[2]:
-            attendees_b['Board'].append(attendee)
-        elif attendee_group[1]:
-            attendees_b['Volunteers'].append(attendee)
-        elif attendee_group[0]:
-            attendees_b['Members'].append(attendee)
-        else:
-            attendees_b['Nonmembers'].append(attendee)
+    """Compute and return statistics about event attendance.
+
+    Either argument may be an events list or an already built Attendance snapshot.
+    For three or more groups, use venn_partitions directly. Two views of a matrix.AttendanceMatrix
+    are compared by the matrix, with set operations over its arrays.
+    """
+    if hasattr(events_list_a, 'compare'):
+        return events_list_a.compare(events_list_b)
+
+    attendance_a = snapshot(events_list_a)
+    attendance_b = snapshot(events_list_b)
+    attendees_a = attendance_a.emails()
+    attendees_b = attendance_b.emails()
+
+    partitions = venn_partitions(attendance_a, attendance_b)
 
     # Generate the comparisons
     comparison = {}
-    comparison['a_or_b'] = {'All': attendees_a['All'] + attendees_b['All'],
-                            'Nonmembers': attendees_a['Nonmembers'] + attendees_b['Nonmembers'],
-                            'Members': attendees_a['Members'] + attendees_b['Members'],
-                            'Volunteers': attendees_a['Volunteers'] + attendees_b['Volunteers'],
-                            'Board': attendees_a['Board'] + attendees_b['Board']}
-
-    comparison['a_and_b'] = {'All': [e for e in attendees_a['All'] if e in attendees_b['All']],
-                             'Nonmembers': [e for e in attendees_a['Nonmembers'] if e in attendees_b['Nonmembers']],
-                             'Members': [e for e in attendees_a['Members'] if e in attendees_b['Members']],
-                             'Volunteers': [e for e in attendees_a['Volunteers'] if e in attendees_b['Volunteers']],
-                             'Board': [e for e in attendees_a['Board'] if e in attendees_b['Board']]}
-
-    comparison['a_not_b'] = {'All': [e for e in attendees_a['All'] if e not in attendees_b['All']],
-                             'Nonmembers': [e for e in attendees_a['Nonmembers'] if e not in attendees_b['Nonmembers']],
-                             'Members': [e for e in attendees_a['Members'] if e not in attendees_b['Members']],
-                             'Volunteers': [e for e in attendees_a['Volunteers'] if e not in attendees_b['Volunteers']],
-                             'Board': [e for e in attendees_a['Board'] if e not in attendees_b['Board']]}
-
-    comparison['b_not_a'] = {'All': [e for e in attendees_b['All'] if e not in attendees_a['All']],
-                             'Nonmembers': [e for e in attendees_b['Nonmembers'] if e not in attendees_a['Nonmembers']],
-                             'Members': [e for e in attendees_b['Members'] if e not in attendees_a['Members']],
-                             'Volunteers': [e for e in attendees_b['Volunteers'] if e not in attendees_a['Volunteers']],
-                             'Board': [e for e in attendees_b['Board'] if e not in attendees_a['Board']]}
-
-    conn.close()
+    comparison['a_or_b'] = {category: attendees_a[category] + attendees_b[category]
+                            for category in CATEGORIES}
+    for key, mask in (('a_and_b', 0b11), ('a_not_b', 0b01), ('b_not_a', 0b10)):
+        comparison[key] = partitions.get(mask, {category: [] for category in CATEGORIES})
+
     return comparison
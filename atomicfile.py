@@ -0,0 +1,20 @@
+"""Replace files atomically, so that readers never see one half written."""
+from contextlib import contextmanager
+import os
+import threading
+
+
+@contextmanager
+def replacing(target):
+    """Yield a temporary path next to target, which replaces target once the with block succeeds.
+
+    The temporary name carries the process and thread IDs, so concurrent writers of the same
+    target, in this process or any other, never share one. It is removed if the block fails.
+    """
+    partial_file = '{}.{}.{}.tmp'.format(target, os.getpid(), threading.get_ident())
+    try:
+        yield partial_file
+        os.replace(partial_file, target)
+    finally:
+        if os.path.exists(partial_file):
+            os.remove(partial_file)
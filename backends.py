@@ -0,0 +1,257 @@
+"""Render report metrics, as computed by orchestrator, in formats that need no LaTeX.
+
+Each backend turns the metrics dictionary of a standard or comparison report (see
+orchestrator.standard_metrics and orchestrator.comparison_metrics) into text:
+
+    json  the metrics themselves
+    csv   one row per number, as section, group, item, category, value
+    html  a self-contained page with the report's tables, and its charts as inline SVG
+
+PDF reports go through LaTeX in orchestrator instead.
+"""
+from html import escape
+import csv
+import io
+import json
+import os
+import sys
+import atomicfile
+
+CATEGORIES = ('Nonmembers', 'Members', 'Volunteers', 'Board', 'All')  # in the order of the PDF tables
+COLORS = {'Board': '#66c2a5', 'Volunteers': '#fc8d62', 'Members': '#8da0cb', 'Nonmembers': '#e78ac3'}
+MEASURES = (('total', 'Total Attendance', '%d'), ('distinct', 'Distinct Attendees', '%d'),
+            ('average_attendance', 'Average Attendees', '%.3f'),
+            ('average_events', 'Average Events Attended', '%.3f'))
+OVERLAPS = (('a_and_b', 'Both'), ('a_not_b', 'Only A'), ('b_not_a', 'Only B'))
+STYLE = '''
+body { font-family: sans-serif; margin: 2em auto; max-width: 70em; color: #222; }
+table { border-collapse: collapse; margin: 1em 0; }
+th, td { border: 1px solid #999; padding: .3em .8em; text-align: center; }
+tr:last-child td { font-weight: bold; }
+svg { display: block; margin: 1em 0; }
+svg text { font-size: 12px; }
+.venns svg { display: inline-block; }
+pre { columns: 3; }
+'''
+
+
+def display_name(group):
+    """Return a group name from the metrics with its LaTeX quotes made typographic."""
+    return group.replace('`', '\u2018').replace("'", '\u2019')
+
+
+def render_json(metrics):
+    """Render metrics as JSON."""
+    return json.dumps(metrics, indent=2) + '\n'
+
+
+def csv_rows(metrics):
+    """Yield the (section, group, item, category, value) rows of the metrics."""
+    if metrics['report'] == 'standard':
+        groups = {'': metrics}
+    else:
+        groups = metrics['groups']
+
+    for group_name, group in groups.items():
+        yield 'group', group_name, group['group'], '', ''
+        for measure, label, number_format in MEASURES:
+            for category in CATEGORIES:
+                yield measure, group_name, '', category, group[measure][category]
+        for event in group['events']:
+            for category in CATEGORIES:
+                yield ('event', group_name, event['name'] + ' ' + event['time'], category,
+                       event['counts'][category])
+        for delta, attendees in group['arrivals']:
+            yield 'arrivals', group_name, delta, 'All', attendees
+
+    if 'overlap' in metrics:
+        for overlap, label in OVERLAPS:
+            for category in CATEGORIES:
+                yield 'overlap', overlap, '', category, metrics['overlap'][overlap][category]
+
+    for group_name, email_lists in email_groups(metrics):
+        for category in CATEGORIES[:-1]:
+            for email in email_lists[category]:
+                yield 'email', group_name, email, category, ''
+
+
+def email_groups(metrics):
+    """Return (group, email lists per category) pairs for the emails in metrics, if any."""
+    if 'emails' not in metrics:
+        return []
+    if metrics['report'] == 'standard':
+        return [('', metrics['emails'])]
+    return [(overlap, metrics['emails'][overlap]) for overlap, label in OVERLAPS]
+
+
+def render_csv(metrics):
+    """Render metrics as CSV, one row per number."""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow(['section', 'group', 'item', 'category', 'value'])
+    writer.writerows(csv_rows(metrics))
+    return out.getvalue()
+
+
+def svg_bar_chart(events, title):
+    """Return an SVG stacked horizontal bar chart of the attendance of events, latest event first."""
+    label_width, bar_width, row_height = 260, 640, 22
+    height = 50 + row_height * len(events)
+    widest = max([event['counts']['All'] for event in events] + [1])
+    parts = ['<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d">' % (
+                 label_width + bar_width + 130, height),
+             '<text x="%d" y="20" font-weight="bold">%s</text>' % (label_width, escape(title))]
+
+    for row, event in enumerate(reversed(events)):
+        y = 35 + row * row_height
+        parts.append('<text x="%d" y="%d" text-anchor="end">%s %s</text>' % (
+            label_width - 8, y + 15, escape(event['name']), escape(event['time'][:10])))
+        x = label_width
+        for category in ('Board', 'Volunteers', 'Members', 'Nonmembers'):
+            width = bar_width * event['counts'][category] / widest
+            parts.append('<rect x="%.1f" y="%d" width="%.1f" height="%d" fill="%s">'
+                         '<title>%s: %d</title></rect>' % (
+                             x, y, width, row_height - 4, COLORS[category], category,
+                             event['counts'][category]))
+            x += width
+
+    for i, category in enumerate(('Board', 'Volunteers', 'Members', 'Nonmembers')):
+        y = 35 + i * 18
+        parts.append('<rect x="%d" y="%d" width="12" height="12" fill="%s"/>'
+                     '<text x="%d" y="%d">%s</text>' % (
+                         label_width + bar_width + 15, y, COLORS[category],
+                         label_width + bar_width + 32, y + 11, category))
+    parts.append('</svg>')
+    return ''.join(parts)
+
+
+def svg_arrival_chart(arrivals, low=-20, high=40):
+    """Return an SVG line plot of an arrival time histogram, between low and high minutes."""
+    width, height, margin = 600, 260, 40
+    shown = [(delta, attendees) for delta, attendees in arrivals if low <= delta <= high]
+    tallest = max([attendees for delta, attendees in shown] + [1])
+
+    def x(delta):
+        return margin + (width - 2 * margin) * (delta - low) / (high - low)
+
+    def y(attendees):
+        return height - margin - (height - 2 * margin) * attendees / tallest
+
+    parts = ['<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d">' % (width, height),
+             '<text x="%d" y="20" font-weight="bold">Relative Arrival Times</text>' % margin,
+             '<line x1="%d" y1="%d" x2="%d" y2="%d" stroke="#999"/>' % (
+                 margin, height - margin, width - margin, height - margin)]
+    for tick in range(low, high + 1, 10):
+        parts.append('<text x="%.1f" y="%d" text-anchor="middle">%d</text>' % (
+            x(tick), height - margin + 16, tick))
+    parts.append('<text x="%d" y="%d" text-anchor="middle">(Arrival Time - Start Time)</text>' % (
+        width / 2, height - 6))
+    if shown:
+        parts.append('<polyline fill="none" stroke="%s" stroke-width="2" points="%s"/>' % (
+            COLORS['Board'], ' '.join('%.1f,%.1f' % (x(delta), y(attendees))
+                                      for delta, attendees in shown)))
+    parts.append('</svg>')
+    return ''.join(parts)
+
+
+def svg_venn(only_a, only_b, both, title):
+    """Return an SVG two-set Venn diagram of the attendees only in A, only in B and in both."""
+    return ''.join([
+        '<svg xmlns="http://www.w3.org/2000/svg" width="220" height="170">',
+        '<text x="110" y="16" text-anchor="middle" font-weight="bold">%s</text>' % escape(title),
+        '<circle cx="80" cy="95" r="60" fill="%s" fill-opacity=".5"/>' % COLORS['Nonmembers'],
+        '<circle cx="140" cy="95" r="60" fill="%s" fill-opacity=".5"/>' % COLORS['Board'],
+        '<text x="55" y="100" text-anchor="middle">%d</text>' % only_a,
+        '<text x="165" y="100" text-anchor="middle">%d</text>' % only_b,
+        '<text x="110" y="100" text-anchor="middle">%d</text>' % both,
+        '<text x="40" y="165">A</text><text x="175" y="165">B</text>',
+        '</svg>',
+    ])
+
+
+def html_table(groups):
+    """Return an HTML table of the attendee counts of (label, group metrics) pairs."""
+    header = '<tr><th>Group</th>' + ''.join(
+        '<th>%s%s</th>' % (label + ': ' if label else '', measure_label)
+        for label, group in groups for measure, measure_label, number_format in MEASURES) + '</tr>'
+    rows = ['<table>', header]
+    for category in CATEGORIES:
+        rows.append('<tr><td>%s</td>%s</tr>' % (category, ''.join(
+            '<td>%s</td>' % (number_format % group[measure][category])
+            for label, group in groups for measure, measure_label, number_format in MEASURES)))
+    rows.append('</table>')
+    return ''.join(rows)
+
+
+def html_emails(metrics):
+    """Return collapsible HTML lists of the emails in metrics, if any."""
+    parts = []
+    labels = dict(OVERLAPS)
+    for group_name, email_lists in email_groups(metrics):
+        for category in CATEGORIES[:-1]:
+            parts.append('<details><summary>%s emails (%d)</summary><pre>%s</pre></details>' % (
+                escape(' '.join(filter(None, [labels.get(group_name), category]))),
+                len(email_lists[category]), escape('\n'.join(email_lists[category]))))
+    return ''.join(parts)
+
+
+def render_html(metrics):
+    """Render metrics as a self-contained HTML page, with inline SVG charts."""
+    if metrics['report'] == 'standard':
+        title = display_name(metrics['group'])
+        body = [
+            '<h1>%s</h1>' % escape(title),
+            svg_bar_chart(metrics['events'], 'Event Attendance at ' + title),
+            html_table([('', metrics)]),
+            svg_arrival_chart(metrics['arrivals']),
+        ]
+    else:
+        group_a, group_b = metrics['groups']['a'], metrics['groups']['b']
+        overlap = metrics['overlap']
+        name_a, name_b = display_name(group_a['group']), display_name(group_b['group'])
+        title = 'COMPARISON: (A): %s & (B): %s' % (name_a, name_b)
+        body = [
+            '<h1>%s</h1>' % escape(title),
+            svg_bar_chart(group_a['events'], '(A): Event Attendance at ' + name_a),
+            svg_bar_chart(group_b['events'], '(B): Event Attendance at ' + name_b),
+            html_table([('A', group_a), ('B', group_b)]),
+            '<div class="venns">' + ''.join(
+                svg_venn(overlap['a_not_b'][category], overlap['b_not_a'][category],
+                         overlap['a_and_b'][category], category)
+                for category in ('All', 'Board', 'Volunteers', 'Members', 'Nonmembers')) + '</div>',
+        ]
+    body.append(html_emails(metrics))
+    return ('<!DOCTYPE html>\n<html><head><meta charset="utf-8"><title>%s</title><style>%s</style>'
+            '</head><body>\n%s\n</body></html>\n' % (escape(title), STYLE, '\n'.join(body)))
+
+
+BACKENDS = {
+    # format: (file extension, renderer, media type)
+    'json': ('.json', render_json, 'application/json'),
+    'csv': ('.csv', render_csv, 'text/csv; charset=utf-8'),
+    'html': ('.html', render_html, 'text/html; charset=utf-8'),
+}
+
+
+def render(output_format, metrics):
+    """Render metrics in output_format, one of BACKENDS."""
+    if output_format not in BACKENDS:
+        raise ValueError('unknown output format: {}'.format(output_format))
+    return BACKENDS[output_format][1](metrics)
+
+
+def write(output_format, metrics, output):
+    """Render metrics in output_format into the file output, or to stdout if output is '-'.
+
+    Returns output.
+    """
+    text = render(output_format, metrics)
+    if output == '-':
+        sys.stdout.write(text)
+        return output
+
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with atomicfile.replacing(output) as partial_file:  # readers never see half a report
+        with open(partial_file, 'w', newline='') as out:  # csv brings its own line endings
+            out.write(text)
+    return output
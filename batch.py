@@ -0,0 +1,120 @@
+"""Generate many standard and comparison reports in one process, from a JSON manifest.
+
+The manifest is a list of reports, each an object such as
+
+    {"name": "spring-workshops", "names": ["Workshop"], "start": "2017-01-01", "end": "2017-05-01",
+     "vs": {"names": ["Workshop"], "start": "2016-08-01", "end": "2016-12-31"}, "emails": false}
+
+where "name" is required and becomes the report's file name, Reports/<name>.pdf; "names",
+"dates", "start" and "end" select events as the command line interface does; and "vs", if
+present, selects a second group of events and makes the report a comparison report. An
+optional "format" of "html", "json" or "csv" writes the report in that format instead of
+as a PDF, to Reports/<name> with the format's extension.
+
+Reports run concurrently on a pool of threads, which share db's pool of database connections,
+attendance snapshots, a single chart rendering process pool and a bounded pool of pdflatex
+runs, whose template formats (see typeset) are built before the first report starts.
+"""
+import orchestrator
+import eventselector
+import instrument
+import typeset
+
+import argparse
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from os import cpu_count
+
+
+def run_entry(entry, snapshots, pool, verbose=False, output=None, conn=None, matrix=None,
+              latex_pool=None):
+    """Generate the report described by one manifest entry, returning the path of the report.
+
+    The report goes to output if given, otherwise to Reports/<name>.pdf, or the extension of
+    the entry's format. The report reads through
+    conn if given, otherwise through a connection borrowed from db's pool, and takes its
+    attendance from matrix, a matrix.AttendanceMatrix, if given. pdflatex runs on latex_pool
+    if given.
+    """
+    selection = eventselector.parse_selection(
+        entry.get('names', []), entry.get('dates', []), entry.get('start'), entry.get('end')
+    )
+
+    if 'vs' not in entry:
+        return orchestrator.standard_report(
+            *selection, include_emails=entry.get('emails', False), verbose=verbose,
+            jobname=entry['name'], output=output, conn=conn, snapshots=snapshots, pool=pool,
+            matrix=matrix, latex_pool=latex_pool, output_format=entry.get('format', 'pdf')
+        )
+
+    vs = entry['vs']
+    selection_vs = eventselector.parse_selection(
+        vs.get('names', []), vs.get('dates', []), vs.get('start'), vs.get('end')
+    )
+    return orchestrator.comparison_report(
+        selection, selection_vs, include_emails=entry.get('emails', False), verbose=verbose,
+        jobname=entry['name'], output=output, conn=conn, snapshots=snapshots, pool=pool,
+        matrix=matrix, latex_pool=latex_pool, output_format=entry.get('format', 'pdf')
+    )
+
+
+def main():
+    """Execute when program is directly invoked."""
+    parser = argparse.ArgumentParser(description='Org Analytics batch report generator.')
+    parser.add_argument('manifest', help='JSON file listing the reports to generate')
+    parser.add_argument(
+        '--workers', '-w', type=int, default=4,
+        help='Number of reports to generate concurrently.'
+    )
+    parser.add_argument(
+        '--latex-workers', type=int, default=cpu_count() or 1,
+        help='Number of pdflatex runs at once, one per core by default.'
+    )
+    parser.add_argument(
+        '--matrix', '-m', dest='matrix', action='store_true',
+        help='Load all attendance into memory once, instead of querying it per report.'
+    )
+    parser.add_argument(
+        '--verbose', '-v', dest='verbose', action='store_true',
+        help="Show more information during report generation."
+    )
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+
+    with open(args.manifest) as manifest:
+        entries = json.load(manifest)
+    jobnames = [entry['name'] for entry in entries]
+    if len(set(jobnames)) != len(jobnames):
+        raise ValueError('report names in the manifest must be distinct')
+
+    with instrument.session(args):
+        attendance = None
+        if args.matrix:
+            import matrix
+            attendance = matrix.AttendanceMatrix()
+            print('attendance matrix: {:.1f} MiB'.format(attendance.nbytes() / 2 ** 20), file=sys.stderr)
+
+        typeset.prepare(set('comparison' if 'vs' in entry else 'standard' for entry in entries
+                            if entry.get('format', 'pdf') == 'pdf'))
+
+        snapshots = {}
+        failed = False
+        with ProcessPoolExecutor() as chart_pool, ThreadPoolExecutor(args.workers) as report_pool, \
+                ThreadPoolExecutor(args.latex_workers) as latex_pool:
+            futures = [
+                report_pool.submit(run_entry, entry, snapshots, chart_pool, args.verbose,
+                                   matrix=attendance, latex_pool=latex_pool)
+                for entry in entries
+            ]
+            for entry, future in zip(entries, futures):
+                try:
+                    print('{}: {}'.format(entry['name'], future.result()))
+                except Exception as error:
+                    print('{}: failed ({})'.format(entry['name'], error), file=sys.stderr)
+                    failed = True
+
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""Generate synthetic participation exports, and databases loaded from them, for benchmarking.
+
+Exports are real xlsx workbooks in the layout loader expects: a Participation sheet with a
+label row, then one row per attendee with the event time in column 0, last and first names
+in columns 2 and 3, the email in column 4, the check-in time (blank for manual check-ins)
+in column 9 and the comma separated group list in column 11.
+
+    python benchmarks/generate.py OUT_DIR [--events N] [--attendees N] [--students N] [--db FILE]
+"""
+from datetime import datetime, timedelta
+from os.path import abspath, dirname, join
+from xml.sax.saxutils import escape
+import argparse
+import os
+import random
+import sys
+import zipfile
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import loader  # noqa: E402
+
+EVENT_NAMES = ('Career Fair', 'Workshop', 'Social', 'Info Session', 'Hackathon', 'Tech Talk',
+               'Study Break', 'Volunteer Meeting', 'Mock Interviews', 'Alumni Panel')
+GROUPS = (  # group lists, and how often students carry them
+    ('', 40), ('General Members', 35), ('General Members, CSO Pillar Volunteers', 15),
+    ('CSO Pillar Volunteers', 3), ('CSO Board, General Members', 5), ('Other Org', 2),
+)
+LABELS = ('Event Time', 'Event', 'Last Name', 'First Name', 'Email', 'Phone', 'Major', 'Year',
+          'RSVP', 'Check-in Time', 'Notes', 'Groups')
+TIME_FORMAT = '%Y-%m-%d %I:%M %p'
+FIRST_EVENT = datetime(2015, 8, 20, 18, 0)
+MANUAL_RATE = .1  # share of check-ins entered by hand, without a time
+
+CONTENT_TYPES = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>
+<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>
+<Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>
+</Types>'''
+ROOT_RELS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>
+</Relationships>'''
+WORKBOOK = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">
+<sheets><sheet name="Participation" sheetId="1" r:id="rId1"/></sheets>
+</workbook>'''
+WORKBOOK_RELS = '''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>
+<Relationship Id="rId2" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings" Target="sharedStrings.xml"/>
+</Relationships>'''
+
+
+def column_name(index):
+    """Return the spreadsheet column letters of a zero-based column index."""
+    name = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        name = chr(ord('A') + remainder) + name
+    return name
+
+
+def write_xlsx(path, rows):
+    """Write rows, lists of strings, as the Participation sheet of an xlsx workbook at path.
+
+    Blank strings are left out, as spreadsheet programs do with empty cells.
+    """
+    strings = {}
+    sheet_rows = []
+    for r, row in enumerate(rows, 1):
+        cells = []
+        for c, value in enumerate(row):
+            if value == '':
+                continue
+            index = strings.setdefault(value, len(strings))
+            cells.append('<c r="%s%d" t="s"><v>%d</v></c>' % (column_name(c), r, index))
+        sheet_rows.append('<row r="%d">%s</row>' % (r, ''.join(cells)))
+
+    sheet = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n' +
+             '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">' +
+             '<sheetData>' + ''.join(sheet_rows) + '</sheetData></worksheet>')
+    shared = ('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n' +
+              '<sst xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" ' +
+              'count="%d" uniqueCount="%d">' % (len(strings), len(strings)) +
+              ''.join('<si><t>%s</t></si>' % escape(value) for value in strings) + '</sst>')
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as book:
+        book.writestr('[Content_Types].xml', CONTENT_TYPES)
+        book.writestr('_rels/.rels', ROOT_RELS)
+        book.writestr('xl/workbook.xml', WORKBOOK)
+        book.writestr('xl/_rels/workbook.xml.rels', WORKBOOK_RELS)
+        book.writestr('xl/worksheets/sheet1.xml', sheet)
+        book.writestr('xl/sharedStrings.xml', shared)
+
+
+def generate(data_dir, events=50, attendees=60, students=1000, seed=0):
+    """Write events exports of about attendees attendees each, drawn from students, into data_dir.
+
+    Events recur under EVENT_NAMES, one a day, and students sometimes change groups between
+    events, as they do in real exports. Returns the number of attendance rows written.
+    """
+    rng = random.Random(seed)
+    os.makedirs(data_dir, exist_ok=True)
+    names = [('Last%d' % i, 'First%d' % i, 'student%d@gatech.edu' % i) for i in range(students)]
+    group_lists = [group for group, weight in GROUPS]
+    weights = [weight for group, weight in GROUPS]
+    groups = rng.choices(group_lists, weights, k=students)
+    popularity = [rng.paretovariate(1.5) for _ in range(students)]  # regulars and one-timers
+
+    written = 0
+    for i in range(events):
+        name = EVENT_NAMES[i % len(EVENT_NAMES)]
+        start = FIRST_EVENT + timedelta(days=i)
+        size = max(1, min(students, int(rng.gauss(attendees, attendees / 4))))
+        chosen = set()
+        while len(chosen) < size:
+            chosen.update(rng.choices(range(students), popularity, k=size - len(chosen)))
+
+        rows = [list(LABELS)]
+        for student in sorted(chosen):
+            if rng.random() < .02:
+                groups[student] = rng.choices(group_lists, weights)[0]
+            checkin = '' if rng.random() < MANUAL_RATE else (
+                start + timedelta(minutes=round(rng.gauss(5, 12)))).strftime(TIME_FORMAT)
+            last_name, first_name, email = names[student]
+            rows.append([start.strftime(TIME_FORMAT), name, last_name, first_name, email,
+                         '', '', '', '', checkin, '', groups[student]])
+        write_xlsx(join(data_dir, '%s Participation (%d).xlsx' % (name, i)), rows)
+        written += len(rows) - 1
+    return written
+
+
+def build_db(data_dir, db_path, workers=None):
+    """Load every export in data_dir into a fresh database at db_path through loader."""
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(db_path + suffix):
+            os.remove(db_path + suffix)
+    db, loader.DB = loader.DB, db_path
+    try:
+        loader.main(data_dir, workers)
+    finally:
+        loader.DB = db
+
+
+def main():
+    """Execute when program is directly invoked."""
+    parser = argparse.ArgumentParser(description='Synthetic participation data generator.')
+    parser.add_argument('out', help='Directory to write the xlsx exports to')
+    parser.add_argument('--events', '-e', type=int, default=50, help='Number of events.')
+    parser.add_argument('--attendees', '-a', type=int, default=60, help='Mean attendees per event.')
+    parser.add_argument('--students', '-s', type=int, default=1000, help='Number of distinct students.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+    parser.add_argument('--db', metavar='FILE', help='Also load the exports into a fresh database FILE.')
+    args = parser.parse_args()
+
+    rows = generate(args.out, args.events, args.attendees, args.students, args.seed)
+    print('Wrote {} rows in {} exports to {}'.format(rows, args.events, args.out))
+    if args.db:
+        build_db(args.out, args.db)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,235 @@
+"""Time ingest, analyses, event selection, chart rendering and full reports on synthetic data.
+
+Data is generated by benchmarks/generate.py at one of SCALES (or any --events, --attendees
+and --students), into a scratch directory. Results are printed and written as JSON, and may
+be compared against an earlier run's JSON:
+
+    python benchmarks/harness.py --scale medium --out after.json --compare before.json
+
+PDF reports run only when pdflatex is on the PATH.
+"""
+from datetime import datetime
+from os.path import abspath, dirname, join
+from statistics import median
+from time import perf_counter
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, dirname(abspath(__file__)))
+
+import analyses  # noqa: E402
+import backends  # noqa: E402
+import db  # noqa: E402
+import eventselector  # noqa: E402
+import generate  # noqa: E402
+import loader  # noqa: E402
+import matrix  # noqa: E402
+import orchestrator  # noqa: E402
+import plotter  # noqa: E402
+import typeset  # noqa: E402
+
+# (events, mean attendees per event, students)
+SCALES = {
+    'small': (50, 60, 1000),
+    'medium': (300, 150, 5000),
+    'large': (1500, 300, 20000),
+}
+
+
+def timed(results, name, function, *args, runs=5, **kwargs):
+    """Call function runs times, record the median and fastest wall time under name, and return its result."""
+    samples = []
+    for _ in range(runs):
+        start = perf_counter()
+        result = function(*args, **kwargs)
+        samples.append(perf_counter() - start)
+    results[name] = {'runs': runs, 'median': median(samples), 'min': min(samples)}
+    print('{:<40} {:10.4f}s median {:10.4f}s min'.format(name, median(samples), min(samples)))
+    return result
+
+
+def bench_ingest(results, data_dir, db_path):
+    """Time a fresh load of every export, then a rerun that finds nothing changed."""
+    timed(results, 'ingest: fresh', generate.build_db, data_dir, db_path, runs=1)
+    timed(results, 'ingest: unchanged', loader.main, data_dir, runs=1)
+
+
+def bench_selection(results, cur):
+    """Time compiling and running selections by name, by many dates, and by date range."""
+    cur.execute('SELECT DISTINCT name FROM events')
+    names = [row[0] for row in cur.fetchall()]
+    cur.execute('SELECT DISTINCT date(time) FROM events')
+    dates = [datetime.strptime(row[0], '%Y-%m-%d') for row in cur.fetchall()]
+    date_range = (min(dates), min(dates) + (max(dates) - min(dates)) / 2)
+
+    selections = {'one name': (names[:1], [], ()), 'every name': (names, [], ()),
+                  'every date': ([], dates, ()), 'date range': ([], [], date_range)}
+    for label, selection in selections.items():
+        query = timed(results, 'build_query: ' + label, eventselector.build_query, *selection, runs=20)
+        timed(results, 'select events: ' + label, lambda: cur.execute(*query).fetchall())
+    return selections
+
+
+def bench_analyses(results, cur, selections):
+    """Time snapshots, every analyses function, and the matrix engine over the selections."""
+    events = {}
+    for label, selection in selections.items():
+        events[label] = cur.execute(*eventselector.build_query(*selection)).fetchall()
+    group_a, group_b = events['date range'], events['one name']
+
+    timed(results, 'Attendance: date range', analyses.Attendance, group_a, cur)
+    for mode in ('', 'distinct_only', 'average_attendance', 'average_events'):
+        kwargs = {mode: True} if mode else {}
+        timed(results, 'count_attendees: ' + (mode or 'total'), analyses.count_attendees,
+              group_a, **kwargs)
+    timed(results, 'list_emails', analyses.list_emails, group_a)
+    timed(results, 'get_arrival_deltas', analyses.get_arrival_deltas, group_a)
+    timed(results, 'compare_attendees', analyses.compare_attendees, group_a, group_b)
+    timed(results, 'venn_partitions: 3 groups', analyses.venn_partitions,
+          group_a, group_b, events['every name'])
+
+    selection = selections['date range']
+    with db.connection(readonly=False) as conn:  # so the first select misses
+        conn.execute('DELETE FROM memo')
+        conn.commit()
+    timed(results, 'select: memo miss', analyses.select, cur, *selection, runs=1)
+    timed(results, 'select: memo hit', analyses.select, cur, *selection)
+
+    attendance = timed(results, 'matrix: load', matrix.AttendanceMatrix, cur, runs=1)
+    results['matrix: bytes'] = attendance.nbytes()
+    view_a = timed(results, 'matrix: view date range', attendance.view, group_a)
+    view_b = attendance.view(group_b)
+    timed(results, 'matrix: counts', view_a.counts)
+    timed(results, 'matrix: event_counts', view_a.event_counts)
+    timed(results, 'matrix: compare', analyses.compare_attendees, view_a, view_b)
+    return analyses.Attendance(group_a, cur)
+
+
+def bench_charts(results, attendance):
+    """Time drawing each chart type, uncached and then from the chart cache."""
+    plotter.CACHE_DIR = join(os.getcwd(), 'chart-cache')
+    charts = [
+        ('arrival_chart', (attendance.arrival_deltas(), 'arrival.png'), {}),
+        ('bar_chart', (orchestrator.bar_chart_rows(orchestrator.group_metrics(attendance)['events']),
+                       'bar.png'), {'title': 'Benchmark'}),
+        ('venn_diagram', ((10, 20, 5), 'venn.png'), {'title': 'Benchmark'}),
+    ]
+    os.makedirs(plotter.WORK_DIR, exist_ok=True)
+    for name, args, kwargs in charts:
+        chart = getattr(plotter, name)
+        timed(results, 'chart: ' + name, chart.__wrapped__, *args, runs=3, **kwargs)
+        plotter.render((name, args, kwargs))  # fill the cache
+        timed(results, 'chart: ' + name + ' cached', chart, *args, **kwargs)
+
+
+def bench_reports(results, selections):
+    """Time reports in every format; PDFs built afresh and then from the document cache."""
+    for output_format in backends.BACKENDS:
+        timed(results, 'standard_report: ' + output_format, orchestrator.standard_report,
+              *selections['date range'], output='standard.' + output_format,
+              output_format=output_format)
+        timed(results, 'comparison_report: ' + output_format, orchestrator.comparison_report,
+              selections['date range'], selections['one name'],
+              output='comparison.' + output_format, output_format=output_format)
+
+    if shutil.which('pdflatex') is None:
+        print('pdflatex not found; skipping reports')
+        return
+    reports = {
+        'standard_report': (orchestrator.standard_report, selections['date range']),
+        'comparison_report': (orchestrator.comparison_report,
+                              (selections['date range'], selections['one name'])),
+    }
+    for name, (report, args) in reports.items():
+        def build():
+            shutil.rmtree(typeset.DOCUMENT_DIR, ignore_errors=True)
+            report(*args, output=name + '.pdf')
+        timed(results, name, build, runs=3)
+        timed(results, name + ': cached', report, *args, output=name + '.pdf', runs=3)
+
+
+def compare(results, baseline):
+    """Print how each timing changed against a baseline run's results."""
+    print('\n{:<40} {:>10} {:>10} {:>8}'.format('vs baseline', 'before', 'after', 'ratio'))
+    for name, result in results['timings'].items():
+        before = baseline['timings'].get(name)
+        if isinstance(result, dict) and isinstance(before, dict) and before['median']:
+            print('{:<40} {:10.4f} {:10.4f} {:7.2f}x'.format(
+                name, before['median'], result['median'], result['median'] / before['median']))
+
+
+def main():
+    """Execute when program is directly invoked."""
+    parser = argparse.ArgumentParser(description='Org Analytics benchmark harness.')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='small', help='Data size.')
+    parser.add_argument('--events', type=int, help='Number of events, overriding the scale.')
+    parser.add_argument('--attendees', type=int, help='Mean attendees per event, overriding the scale.')
+    parser.add_argument('--students', type=int, help='Number of students, overriding the scale.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed of the generated data.')
+    parser.add_argument('--out', metavar='FILE', help='Write the results to FILE as JSON.')
+    parser.add_argument('--compare', metavar='FILE', help='Compare against earlier results in FILE.')
+    parser.add_argument('--skip', nargs='*', default=[],
+                        choices=['ingest', 'analyses', 'charts', 'reports'],
+                        help='Stages to leave out.')
+    args = parser.parse_args()
+
+    events, attendees, students = SCALES[args.scale]
+    events = args.events or events
+    attendees = args.attendees or attendees
+    students = args.students or students
+
+    cwd = os.getcwd()
+    timings = {}
+    with tempfile.TemporaryDirectory(prefix='org-analytics-bench-') as scratch:
+        # reports resolve Templates/ and write .working/ relative to the working directory
+        os.chdir(scratch)
+        os.symlink(join(ROOT, 'Templates'), 'Templates')
+        data_dir = join(scratch, 'data')
+        loader.DB = join(scratch, 'bench.db')
+
+        rows = timed(timings, 'generate', generate.generate, data_dir, events, attendees,
+                     students, args.seed, runs=1)
+        if 'ingest' in args.skip:
+            generate.build_db(data_dir, loader.DB)
+        else:
+            bench_ingest(timings, data_dir, loader.DB)
+
+        with db.connection() as conn:
+            cur = conn.cursor()
+            selections = bench_selection(timings, cur)
+            if 'analyses' not in args.skip:
+                attendance = bench_analyses(timings, cur, selections)
+            else:
+                attendance = analyses.Attendance(cur.execute(
+                    *eventselector.build_query(*selections['date range'])).fetchall(), cur)
+        if 'charts' not in args.skip:
+            bench_charts(timings, attendance)
+        if 'reports' not in args.skip:
+            bench_reports(timings, selections)
+        db.pool().close()
+        os.chdir(cwd)
+
+    results = {
+        'date': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scale': {'events': events, 'attendees': attendees, 'students': students,
+                  'seed': args.seed, 'rows': rows},
+        'timings': timings,
+    }
+    if args.out:
+        with open(args.out, 'w') as out:
+            json.dump(results, out, indent=2)
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(results, json.load(baseline))
+
+if __name__ == '__main__':
+    main()
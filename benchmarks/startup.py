@@ -0,0 +1,61 @@
+"""Measure the start-up cost of each entry point, to keep cron and interactive runs fast.
+
+For every entry point this reports the median cumulative import time, as measured by
+python -X importtime in a fresh interpreter, and for cli.py the wall time of --help.
+
+    python benchmarks/startup.py [--runs N] [--json FILE]
+"""
+from os.path import abspath, dirname
+from statistics import median
+from time import perf_counter
+import argparse
+import json
+import subprocess
+import sys
+
+ROOT = dirname(dirname(abspath(__file__)))
+ENTRY_POINTS = ('cli', 'loader', 'dbinit')
+
+
+def import_time(module):
+    """Return the cumulative time, in ms, of importing module in a fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import ' + module],
+        cwd=ROOT, stderr=subprocess.PIPE, universal_newlines=True, check=True
+    )
+    for line in result.stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[2].strip() == module:
+            return int(fields[1]) / 1000
+    raise RuntimeError('no import time reported for ' + module)
+
+
+def command_time(*args):
+    """Return the wall time, in ms, of running python with args from the repository root."""
+    start = perf_counter()
+    subprocess.run([sys.executable] + list(args), cwd=ROOT,
+                   stdout=subprocess.DEVNULL, check=True)
+    return (perf_counter() - start) * 1000
+
+
+def main():
+    """Execute when program is directly invoked."""
+    parser = argparse.ArgumentParser(description='Org Analytics start-up benchmark.')
+    parser.add_argument('--runs', '-r', type=int, default=10, help='Samples per measurement.')
+    parser.add_argument('--json', metavar='FILE', help='Also write the results to FILE as JSON.')
+    args = parser.parse_args()
+
+    results = {}
+    for module in ENTRY_POINTS:
+        results['import ' + module] = median(import_time(module) for _ in range(args.runs))
+    results['python -c pass'] = median(command_time('-c', 'pass') for _ in range(args.runs))
+    results['cli.py --help'] = median(command_time('cli.py', '--help') for _ in range(args.runs))
+
+    for name, milliseconds in results.items():
+        print('{:<20} {:8.1f} ms'.format(name, milliseconds))
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(results, out, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,10 @@
 """Command Line Interface to the orchestrator component."""
-import orchestrator
+import backends
+import eventselector
+import instrument
 
 import argparse
+import shlex
 import subprocess
 from datetime import datetime
 
@@ -18,6 +21,20 @@ def main():
         help='Enable generation of email lists.'
     )
     main_parser.set_defaults(emails=False)
+    main_parser.add_argument(
+        '--export-emails', metavar='DEST',
+        help='Instead of a report, export the emails of the attendees (or with vs, of those who '
+             'came to both groups or only one) to one file per category in directory DEST, or '
+             'as CSV to stdout if DEST is -.'
+    )
+    main_parser.add_argument(
+        '--every-attendance', dest='distinct', action='store_false',
+        help='With --export-emails, list attendees once per event attended rather than once.'
+    )
+    main_parser.add_argument(
+        '--unsorted', dest='ordered', action='store_false',
+        help='With --export-emails, skip sorting the emails, which is faster on large selections.'
+    )
 
     main_parser.add_argument(
         '--zathura', dest='reader', action='store_const', const='zathura --fork ',
@@ -28,11 +45,24 @@ def main():
         help="Show report in kde's okular pdf reader."
     )
 
+    main_parser.add_argument(
+        '--format', '-f', dest='output_format', choices=['pdf'] + sorted(backends.BACKENDS),
+        default='pdf',
+        help='Kind of report: a PDF typeset with LaTeX (the default), or the numbers alone as '
+             'a self-contained HTML page, JSON or CSV, which are much faster.'
+    )
+    main_parser.add_argument(
+        '--output', '-o', metavar='FILE',
+        help='Where to write the report, defaults to Reports/standard.pdf or Reports/comparison.pdf '
+             '(with the extension of the format); - writes non-PDF reports to stdout.'
+    )
+
     main_parser.add_argument(
         '--verbose', '-v', dest='verbose', action='store_true',
         help="Show more information during report generation."
     )
     main_parser.set_defaults(verbose=False)
+    instrument.add_arguments(main_parser)
 
     # Event-specifying arguments
     main_parser.add_argument(
@@ -78,32 +108,40 @@ def main():
 
     # Argument Parsing Logic -- reads parsed args and calls orchestrator's report-generating methods
     cargs = main_parser.parse_args()
-    date_range = () if cargs.start is None else (
-        datetime.strptime(cargs.start, "%Y-%m-%d"),
-        datetime.strptime(cargs.end, "%Y-%m-%d")
-    )
-    cargs.dates = [datetime.strptime(date, "%Y-%m-%d") for date in cargs.dates]
-
-    # Call to standard report generator-- 1 event group
-    if cargs.subparser_name is None:
-        orchestrator.standard_report(cargs.names, cargs.dates, date_range, include_emails=cargs.emails)
-        if cargs.reader is not None:
-            subprocess.run(cargs.reader + 'Reports/standard.pdf', shell=True)
-
-    # call to comparison report generator-- 2 event groups
-    elif cargs.subparser_name == 'vs':
-        date_range_vs = () if cargs.start_vs is None else (
-            datetime.strptime(cargs.start_vs, "%Y-%m-%d"),
-            datetime.strptime(cargs.end_vs, "%Y-%m-%d")
-        )
-        cargs.dates_vs = [datetime.strptime(date, "%Y-%m-%d") for date in cargs.dates_vs]
-        orchestrator.comparison_report(
-            (cargs.names, cargs.dates, date_range),
-            (cargs.names_vs, cargs.dates_vs, date_range_vs),
-            include_emails=cargs.emails
-        )
-        if cargs.reader is not None:
-            subprocess.run(cargs.reader + 'Reports/comparison.pdf', shell=True)
+    with instrument.session(cargs):
+        import orchestrator  # only after parsing, so --help and usage errors return immediately
+        selection = eventselector.parse_selection(cargs.names, cargs.dates, cargs.start, cargs.end)
+        selection_vs = None
+        if cargs.subparser_name == 'vs':
+            selection_vs = eventselector.parse_selection(
+                cargs.names_vs, cargs.dates_vs, cargs.start_vs, cargs.end_vs
+            )
+
+        # export of email lists alone, streamed straight from the database
+        if cargs.export_emails is not None:
+            import mailinglist
+            count = mailinglist.export(cargs.export_emails, selection, selection_vs,
+                                       cargs.distinct, cargs.ordered)
+            if cargs.export_emails != '-':
+                print('Wrote {} emails to {}'.format(count, cargs.export_emails))
+            return
+
+        # Call to standard report generator-- 1 event group
+        if cargs.subparser_name is None:
+            report = orchestrator.standard_report(
+                *selection, include_emails=cargs.emails, verbose=cargs.verbose, output=cargs.output,
+                output_format=cargs.output_format
+            )
+
+        # call to comparison report generator-- 2 event groups
+        elif cargs.subparser_name == 'vs':
+            report = orchestrator.comparison_report(
+                selection, selection_vs, include_emails=cargs.emails, verbose=cargs.verbose,
+                output=cargs.output, output_format=cargs.output_format
+            )
+
+    if cargs.reader is not None and cargs.output_format == 'pdf':
+        subprocess.run(cargs.reader + shlex.quote(report), shell=True)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,129 @@
+"""Data access: tuned SQLite connections to loader.DB, and pools to reuse them.
+
+The database runs in WAL mode, so any number of read-only report connections can read
+while loader writes. Reports borrow a connection from the process-wide read-only pool
+for their whole run, through connection(); ingest opens its own writable one with connect().
+"""
+from contextlib import contextmanager
+from os.path import abspath
+from urllib.parse import quote
+import os
+import queue
+import sqlite3
+import threading
+import dbinit
+import instrument
+import loader
+
+POOL_SIZE = 8  # connections per pool; borrowers wait once all of them are in use
+CACHED_STATEMENTS = 256  # per connection; sqlite3's default is 128
+TIMEOUT = 30  # seconds to wait for a lock held by another connection
+PRAGMAS = (
+    'PRAGMA synchronous = NORMAL',  # durable at every checkpoint, which is enough under WAL
+    'PRAGMA cache_size = -65536',  # KiB, so 64 MiB of page cache
+    'PRAGMA mmap_size = 268435456',  # map up to 256 MiB of the file instead of reading it
+    'PRAGMA temp_store = MEMORY',  # sorts and DISTINCT temporaries never touch disk
+)
+
+LOCK = threading.Lock()
+POOLS = {}
+
+
+def prepare(path):
+    """Create or migrate the database at path, and switch it to WAL."""
+    with LOCK:
+        conn = sqlite3.connect(path, timeout=TIMEOUT)
+        try:  # journal_mode is persistent, so once per database is enough
+            conn.execute('PRAGMA journal_mode = WAL')
+        except sqlite3.OperationalError:
+            pass  # in use elsewhere; it works either way, and a later process will switch
+        dbinit.migrate(conn)
+        conn.close()
+
+
+def connect(path=None, readonly=False):
+    """Open a tuned connection to path, loader.DB by default, migrating the database first if needed.
+
+    Read-only connections open the file with mode=ro, so they can never block ingest.
+    Connections may be used from any thread, one at a time.
+    """
+    path = path or loader.DB
+    if readonly and not os.path.exists(path):
+        prepare(path)  # mode=ro cannot create it
+
+    if readonly:
+        conn = sqlite3.connect('file:{}?mode=ro'.format(quote(abspath(path))), uri=True,
+                               timeout=TIMEOUT, cached_statements=CACHED_STATEMENTS,
+                               check_same_thread=False)
+    else:
+        conn = sqlite3.connect(path, timeout=TIMEOUT, cached_statements=CACHED_STATEMENTS,
+                               check_same_thread=False)
+    # checked on every connection, as the file may have been replaced since the last one
+    if conn.execute('PRAGMA user_version').fetchone()[0] < len(dbinit.MIGRATIONS):
+        prepare(path)
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    instrument.watch(conn)
+    return conn
+
+
+class Pool(object):
+    """A bounded pool of connections to one database, lent out one borrower at a time."""
+
+    def __init__(self, path=None, readonly=True, size=POOL_SIZE):
+        """Prepare a pool of up to size connections; they are opened as they are first needed."""
+        self.path = path or loader.DB
+        self.readonly = readonly
+        self.size = size
+        self.idle = queue.LifoQueue()  # most recently used first, its pages are likely still cached
+        self.opened = []
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Borrow a connection, opening one if none is idle, or waiting if size are lent out."""
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self.lock:
+            if len(self.opened) < self.size:
+                conn = connect(self.path, self.readonly)
+                self.opened.append(conn)
+                return conn
+        return self.idle.get()
+
+    def release(self, conn):
+        """Return a borrowed connection to the pool."""
+        if conn.in_transaction:
+            conn.rollback()
+        self.idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Lend a connection for the duration of a with block."""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            self.release(conn)
+
+    def close(self):
+        """Close every connection the pool opened; it must not be used afterwards."""
+        with self.lock:
+            for conn in self.opened:
+                conn.close()
+            self.opened = []
+
+
+def pool(readonly=True):
+    """Return this process's pool of connections to loader.DB."""
+    key = (loader.DB, readonly, os.getpid())  # connections must not cross a fork
+    with LOCK:
+        if key not in POOLS:
+            POOLS[key] = Pool(loader.DB, readonly)
+        return POOLS[key]
+
+
+def connection(readonly=True):
+    """Lend a connection from this process's pool for the duration of a with block."""
+    return pool(readonly).connection()
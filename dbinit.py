@@ -1,19 +1,113 @@
-"""Basic script to start a fresh database."""
-import sqlite3
+"""Create or migrate the database; run directly to start a fresh database."""
 import loader
 from sys import argv
 
-conn = sqlite3.connect(loader.DB)
-c = conn.cursor()
+# Each entry upgrades the schema by one version, as tracked in PRAGMA user_version.
+# Existing databases are migrated in place, so never edit an entry; append a new one.
+MIGRATIONS = [
+    # 1: original schema
+    '''
+    CREATE TABLE IF NOT EXISTS students(email TEXT PRIMARY KEY, name TEXT, is_member BOOLEAN, is_volunteer BOOLEAN, is_board BOOLEAN);
+    CREATE TABLE IF NOT EXISTS events(name TEXT, time TEXT, PRIMARY KEY(name, time));
+    CREATE TABLE IF NOT EXISTS records(event_name TEXT, event_time TEXT, student_email TEXT, checkin_time TEXT, FOREIGN KEY(event_name, event_time) REFERENCES events(name, time), FOREIGN KEY(student_email) REFERENCES students(email));
+    ''',
+    # 2: ingest manifest
+    '''
+    CREATE TABLE IF NOT EXISTS manifest(path TEXT PRIMARY KEY, size INTEGER, mtime REAL, hash TEXT, event_name TEXT, event_time TEXT);
+    ''',
+    # 3: epoch and date columns, NULL instead of 'Manual' check-in times, indexes, WITHOUT ROWID keyed tables
+    '''
+    CREATE TABLE students_new(email TEXT PRIMARY KEY, name TEXT, is_member BOOLEAN, is_volunteer BOOLEAN, is_board BOOLEAN) WITHOUT ROWID;
+    INSERT INTO students_new SELECT email, name, is_member, is_volunteer, is_board FROM students;
+    DROP TABLE students;
+    ALTER TABLE students_new RENAME TO students;
 
-c.execute('PRAGMA foreign_keys = ON;')
+    CREATE TABLE events_new(name TEXT, time TEXT,
+        epoch INTEGER GENERATED ALWAYS AS (CAST(strftime('%s', time) AS INTEGER)) STORED,
+        day TEXT GENERATED ALWAYS AS (date(time)) STORED,
+        PRIMARY KEY(name, time)) WITHOUT ROWID;
+    INSERT INTO events_new(name, time) SELECT name, time FROM events;
+    DROP TABLE events;
+    ALTER TABLE events_new RENAME TO events;
+    CREATE INDEX events_time ON events(time);
+    CREATE INDEX events_day ON events(day);
 
-c.execute('CREATE TABLE students(email TEXT PRIMARY KEY, name TEXT, is_member BOOLEAN, is_volunteer BOOLEAN, is_board BOOLEAN)')
-c.execute('CREATE TABLE events(name TEXT, time TEXT, PRIMARY KEY(name, time))')
-c.execute('''CREATE TABLE records(event_name TEXT, event_time TEXT, student_email TEXT, checkin_time TEXT, FOREIGN KEY(event_name, event_time) REFERENCES events(name, time), FOREIGN KEY(student_email) REFERENCES students(email))''')
+    CREATE TABLE records_new(event_name TEXT, event_time TEXT, student_email TEXT, checkin_time TEXT,
+        checkin_epoch INTEGER GENERATED ALWAYS AS (CAST(strftime('%s', checkin_time) AS INTEGER)) STORED,
+        FOREIGN KEY(event_name, event_time) REFERENCES events(name, time), FOREIGN KEY(student_email) REFERENCES students(email));
+    INSERT INTO records_new(event_name, event_time, student_email, checkin_time)
+        SELECT event_name, event_time, student_email, NULLIF(checkin_time, 'Manual') FROM records;
+    DROP TABLE records;
+    ALTER TABLE records_new RENAME TO records;
+    CREATE INDEX records_event ON records(event_name, event_time, student_email, checkin_epoch);
+    CREATE INDEX records_student ON records(student_email);
+    ''',
+    # 4: per-event attendance and arrival histogram rollups, kept current by loader.refresh_rollups
+    '''
+    CREATE TABLE rollup(event_name TEXT, event_time TEXT, board INTEGER, volunteers INTEGER, members INTEGER, nonmembers INTEGER,
+        PRIMARY KEY(event_name, event_time)) WITHOUT ROWID;
+    CREATE TABLE arrival_rollup(event_name TEXT, event_time TEXT, delta REAL, attendees INTEGER,
+        PRIMARY KEY(event_name, event_time, delta)) WITHOUT ROWID;
+    CREATE TABLE stale_rollups(event_name TEXT, event_time TEXT, PRIMARY KEY(event_name, event_time)) WITHOUT ROWID;
 
-conn.commit()
-conn.close()
+    CREATE TRIGGER students_regrouped AFTER UPDATE OF is_member, is_volunteer, is_board ON students
+    WHEN old.is_member IS NOT new.is_member OR old.is_volunteer IS NOT new.is_volunteer OR old.is_board IS NOT new.is_board
+    BEGIN
+        INSERT INTO stale_rollups
+        SELECT DISTINCT r.event_name, r.event_time FROM records r
+        WHERE r.student_email = new.email AND NOT EXISTS (
+            SELECT 1 FROM stale_rollups x WHERE x.event_name = r.event_name AND x.event_time = r.event_time);
+    END;
 
-if len(argv) == 2:
-    loader.main(argv[1])
+    INSERT INTO rollup
+    SELECT e.name, e.time,
+           count(CASE WHEN s.is_board THEN 1 END),
+           count(CASE WHEN s.is_board THEN NULL WHEN s.is_volunteer THEN 1 END),
+           count(CASE WHEN s.is_board OR s.is_volunteer THEN NULL WHEN s.is_member THEN 1 END),
+           count(CASE WHEN s.email IS NULL OR s.is_board OR s.is_volunteer OR s.is_member THEN NULL ELSE 1 END)
+    FROM events e
+    LEFT JOIN records r ON r.event_name = e.name AND r.event_time = e.time
+    LEFT JOIN students s ON s.email = r.student_email
+    GROUP BY e.name, e.time;
+
+    INSERT INTO arrival_rollup
+    SELECT r.event_name, r.event_time, (r.checkin_epoch - e.epoch) / 60.0, count(*)
+    FROM records r JOIN events e ON e.name = r.event_name AND e.time = r.event_time
+    WHERE r.checkin_epoch IS NOT NULL
+    GROUP BY r.event_name, r.event_time, 3;
+    ''',
+    # 5: data generation counter, bumped by loader on every change, and memoized selections
+    '''
+    CREATE TABLE meta(key TEXT PRIMARY KEY, value) WITHOUT ROWID;
+    INSERT INTO meta VALUES ('generation', 0);
+    CREATE TABLE memo(key TEXT PRIMARY KEY, generation INTEGER, snapshot TEXT) WITHOUT ROWID;
+    ''',
+    # 6: no events.day column or index, as selections only ever compare events.time
+    '''
+    DROP INDEX events_day;
+    ALTER TABLE events DROP COLUMN day;
+    ''',
+]
+
+
+def migrate(conn):
+    """Bring the schema of conn's database up to date, one transaction per migration."""
+    version = conn.execute('PRAGMA user_version').fetchone()[0]
+    if version >= len(MIGRATIONS):
+        return
+
+    # tables are rebuilt in place, which needs foreign key enforcement off
+    foreign_keys = conn.execute('PRAGMA foreign_keys').fetchone()[0]
+    conn.execute('PRAGMA foreign_keys = OFF')
+    for version in range(version, len(MIGRATIONS)):
+        conn.executescript('BEGIN;' + MIGRATIONS[version] +
+                           'PRAGMA user_version = %d; COMMIT;' % (version + 1))
+    conn.execute('PRAGMA foreign_keys = %d' % foreign_keys)
+
+
+if __name__ == '__main__':
+    import db
+    db.prepare(loader.DB)
+
+    if len(argv) == 2:
+        loader.main(argv[1])
@@ -1,39 +1,80 @@
 """Build a query for selecting events. Result should be fed into analyses.py methods."""
-from datetime import datetime
+from collections import namedtuple
+from datetime import datetime, timedelta
+import json
 
+# A compiled selection: a WHERE clause over the events table, and the parameters it takes
+Selection = namedtuple('Selection', ['where', 'params'])
+
+
+def day_bounds(day):
+    """Return the half-open [start, end) bounds of a day, as strings comparable with events.time."""
+    return day.date().isoformat(), (day.date() + timedelta(days=1)).isoformat()
+
+
+def compile_selection(names=[], dates=[], date_range=()):
+    """Compile a selection of events to a Selection: a WHERE clause over events, and its parameters.
+
+    Names are matched as one set, passed as a single JSON array parameter however many there are;
+    dates and the inclusive date range become half-open ranges of events.time, so that the
+    events primary key and time index serve every predicate. Consecutive dates share a range.
+    """
+    clauses = []
+    params = []
 
-def build_query(names=[], dates=[], date_range=()):
-    """Dynamically build a query of events table."""
-    query = 'SELECT * FROM events WHERE ('
-    for name in names:
-        query += 'name=? OR '
     if len(names) >= 1:
-        query = query[:-4] + ') AND ('
+        clauses.append('name IN (SELECT value FROM json_each(?))')
+        params.append(json.dumps(list(names)))
 
-    datestrings = []
     for date in dates:
         if not isinstance(date, datetime):
             raise TypeError('date must be of type datetime.date')
-        query += 'date(time) = date(?) OR '
-        datestrings.append(date.isoformat())
-    if len(dates) >= 1:
-        query = query[:-4] + ') AND ('
+    ranges = []
+    for date in sorted(set(date.date() for date in dates)):
+        if ranges and ranges[-1][1] == date:
+            ranges[-1][1] = date + timedelta(days=1)
+        else:
+            ranges.append([date, date + timedelta(days=1)])
+    if len(ranges) >= 1:
+        clauses.append('(' + ' OR '.join(['(time >= ? AND time < ?)'] * len(ranges)) + ')')
+        params += [bound.isoformat() for day_range in ranges for bound in day_range]
 
     if date_range == ():
-        query = query[:-5]
+        pass
     elif len(date_range) != 2:
         raise ValueError('date_range must be a 2-tuple')
     else:
-        rangestrings = []
         if not isinstance(date_range[0], datetime):
             raise TypeError('start date must be of type datetime.date')
         if not isinstance(date_range[1], datetime):
             raise TypeError('end date must be of type datetime.date')
-        query += 'date(time) BETWEEN ? and ?)'
-        rangestrings.append(date_range[0].isoformat())
-        rangestrings.append(date_range[1].isoformat())
+        clauses.append('time >= ? AND time < ?')
+        params += [day_bounds(date_range[0])[0], day_bounds(date_range[1])[1]]
 
-    return (query, names + datestrings + list(date_range))
+    return Selection(' AND '.join(clauses) or '1', params)
+
+
+def build_query(names=[], dates=[], date_range=()):
+    """Build a query of the (name, time) of every selected event, and its parameters."""
+    selection = compile_selection(names, dates, date_range)
+    return ('SELECT name, time FROM events WHERE ' + selection.where, selection.params)
+
+
+def parse_selection(names=[], dates=[], start=None, end=None):
+    """Convert command line or manifest selection arguments to build_query's (names, dates, date_range).
+
+    Dates are ISO 8601 formatted strings; end defaults to today when only start is given.
+    """
+    if start is None:
+        date_range = ()
+    else:
+        date_range = (
+            datetime.strptime(start, "%Y-%m-%d"),
+            datetime.strptime(end, "%Y-%m-%d") if end is not None else
+            datetime.combine(datetime.today().date(), datetime.min.time())
+        )
+    dates = [datetime.strptime(date, "%Y-%m-%d") for date in dates]
+    return (names, dates, date_range)
 
 
 def name_group(names=[], dates=[], date_range=()):
@@ -0,0 +1,246 @@
+"""Optional instrumentation of report generation: timed spans, SQL query counts and profiles.
+
+Everything is off until enable() is called, and a disabled span costs one global lookup.
+Once enabled, each span records its wall time, how many SQL statements ran inside it
+(counted by the trace callback db.connect installs on every connection) and, while
+tracemalloc is tracing, how much memory it left allocated. Spans nest within each thread;
+a span's counts include those of the spans inside it. Charts drawn in worker processes record
+their spans there and hand them back to plotter.render_all.
+
+Recorded spans can be written in Chrome's trace event format, which chrome://tracing and
+Perfetto show as a timeline, or summarized per stage. The command line tools take the
+flags of add_arguments, and wrap their work in session().
+"""
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+import json
+import os
+import sys
+import threading
+import time
+
+ENABLED = False
+LOCK = threading.Lock()
+SPANS = []  # finished spans of this process, as Chrome trace events
+LOCAL = threading.local()  # per thread: the stack of open spans, and any capture() list
+NULL_SPAN = nullcontext()
+PROFILE_LINES = 25  # functions listed by --profile, by cumulative time
+MEMORY_LINES = 15  # allocation sites listed by --memory
+
+
+def enable():
+    """Start recording spans and counting queries, for the rest of the process."""
+    global ENABLED
+    ENABLED = True
+
+
+def recording():
+    """Return whether spans opened by this thread are being recorded."""
+    return ENABLED or getattr(LOCAL, 'sink', None) is not None
+
+
+class Span(object):
+    """A timed stage; see span."""
+
+    def __init__(self, name, args):
+        self.name = name
+        self.args = args
+        self.queries = 0
+
+    def __enter__(self):
+        import tracemalloc
+        if not hasattr(LOCAL, 'stack'):
+            LOCAL.stack = []
+        LOCAL.stack.append(self)
+        self.memory = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        import tracemalloc
+        end = time.perf_counter()
+        LOCAL.stack.pop()
+        if LOCAL.stack:
+            LOCAL.stack[-1].queries += self.queries
+
+        args = dict(self.args, queries=self.queries)
+        if self.memory is not None and tracemalloc.is_tracing():
+            args['allocated'] = tracemalloc.get_traced_memory()[0] - self.memory
+        event = {'name': self.name, 'ph': 'X', 'ts': self.start * 1e6, 'dur': (end - self.start) * 1e6,
+                 'pid': os.getpid(), 'tid': threading.get_native_id(), 'args': args}
+        sink = getattr(LOCAL, 'sink', None)
+        if sink is not None:
+            sink.append(event)
+        else:
+            with LOCK:
+                SPANS.append(event)
+
+
+def span(name, **args):
+    """Return a context manager timing a with block as the stage name, with args to show alongside."""
+    if not recording():
+        return NULL_SPAN
+    return Span(name, args)
+
+
+def traced(function):
+    """Decorate function so that, while recording, every call is a span named after it.
+
+    A call made directly by the function itself, recursing, is left inside the caller's span.
+    """
+    name = function.__module__ + '.' + function.__qualname__
+
+    @wraps(function)
+    def call(*args, **kwargs):
+        stack = getattr(LOCAL, 'stack', None)
+        if not recording() or (stack and stack[-1].name == name):
+            return function(*args, **kwargs)
+        with Span(name, {}):
+            return function(*args, **kwargs)
+    return call
+
+
+def count_query(statement):
+    """sqlite3 trace callback: count a statement against the innermost open span of its thread."""
+    stack = getattr(LOCAL, 'stack', None)
+    if stack:
+        stack[-1].queries += 1
+
+
+def watch(conn):
+    """Count the statements conn runs, if recording is enabled."""
+    if ENABLED:
+        conn.set_trace_callback(count_query)
+
+
+@contextmanager
+def capture(enabled):
+    """Record the spans of a with block into the list it yields, if enabled.
+
+    For worker processes, whose spans would otherwise never reach the parent; see merge.
+    """
+    if not enabled:
+        yield []
+        return
+    LOCAL.sink = []
+    try:
+        yield LOCAL.sink
+    finally:
+        LOCAL.sink = None
+
+
+def merge(spans):
+    """Add spans recorded by capture in another process to this process's."""
+    with LOCK:
+        SPANS.extend(spans)
+
+
+def summary():
+    """Return the recorded spans totalled per stage name, slowest first.
+
+    Each stage maps to its number of calls, total and longest wall time in seconds, and
+    queries run, and memory allocated when known.
+    """
+    with LOCK:
+        spans = list(SPANS)
+    stages = {}
+    for event in spans:
+        stage = stages.setdefault(event['name'], {'calls': 0, 'total': 0.0, 'max': 0.0, 'queries': 0})
+        stage['calls'] += 1
+        stage['total'] += event['dur'] / 1e6
+        stage['max'] = max(stage['max'], event['dur'] / 1e6)
+        stage['queries'] += event['args']['queries']
+        if 'allocated' in event['args']:
+            stage['allocated'] = stage.get('allocated', 0) + event['args']['allocated']
+    return dict(sorted(stages.items(), key=lambda item: -item[1]['total']))
+
+
+def print_summary(out=sys.stderr):
+    """Print the per-stage summary as a table."""
+    print('{:<48} {:>6} {:>10} {:>10} {:>8}'.format('stage', 'calls', 'total s', 'max s', 'queries'),
+          file=out)
+    for name, stage in summary().items():
+        print('{:<48} {:6d} {:10.4f} {:10.4f} {:8d}'.format(
+            name, stage['calls'], stage['total'], stage['max'], stage['queries']), file=out)
+
+
+def write_trace(filename):
+    """Write the recorded spans to filename in Chrome's trace event format, with the summary."""
+    with LOCK:
+        events = list(SPANS)
+    for pid in sorted(set(event['pid'] for event in events)):
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': pid,
+                       'args': {'name': 'report' if pid == os.getpid() else 'charts %d' % pid}})
+    with open(filename, 'w') as trace:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms',
+                   'otherData': {'summary': summary()}}, trace)
+
+
+@contextmanager
+def profiled(filename=None, out=sys.stderr):
+    """Run a with block under cProfile, printing the costliest functions and saving the stats to filename."""
+    import cProfile
+    import pstats
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield profile
+    finally:
+        profile.disable()
+        if filename:
+            profile.dump_stats(filename)
+        pstats.Stats(profile, stream=out).sort_stats('cumulative').print_stats(PROFILE_LINES)
+
+
+@contextmanager
+def memory_traced(out=sys.stderr):
+    """Trace allocations within a with block, printing the peak and the largest allocation sites."""
+    import tracemalloc
+    tracemalloc.start()
+    try:
+        yield
+    finally:
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print('memory: {:.1f} MiB peak, {:.1f} MiB still allocated'.format(
+            peak / 2 ** 20, current / 2 ** 20), file=out)
+        for stat in snapshot.statistics('lineno')[:MEMORY_LINES]:
+            print(stat, file=out)
+
+
+def add_arguments(parser):
+    """Add the instrumentation flags to an argparse parser."""
+    group = parser.add_argument_group('instrumentation')
+    group.add_argument(
+        '--timings', action='store_true',
+        help='Print the time and SQL queries spent in each stage.'
+    )
+    group.add_argument(
+        '--trace', metavar='FILE',
+        help='Write a timeline of every stage to FILE, in Chrome trace format.'
+    )
+    group.add_argument(
+        '--profile', metavar='FILE', nargs='?', const='',
+        help='Profile with cProfile, printing the costliest functions and saving the stats to FILE.'
+    )
+    group.add_argument(
+        '--memory', action='store_true',
+        help='Trace memory allocations, printing the peak and the largest allocation sites.'
+    )
+
+
+@contextmanager
+def session(args):
+    """Instrument a with block as the flags of add_arguments, parsed into args, ask."""
+    if args.timings or args.trace:
+        enable()
+    with (memory_traced() if args.memory else nullcontext()), \
+            (profiled(args.profile) if args.profile is not None else nullcontext()):
+        try:
+            yield
+        finally:
+            if args.timings:
+                print_summary()
+            if args.trace:
+                write_trace(args.trace)
@@ -2,79 +2,350 @@
 
 """Moves data from xlsx files to sqlite."""
 
-from os import listdir
-from os.path import isfile, join
+from collections import defaultdict, namedtuple
+from functools import lru_cache
+from itertools import islice
+from hashlib import sha256
+from os import cpu_count, listdir, stat
+from os.path import abspath, isfile, join
+from queue import Empty
 from datetime import datetime
-from sys import argv
-import sqlite3
-import xlrd
+from sys import argv, stderr
+from time import perf_counter
+import db
 
 DB = 'GTCSO.db'
+BATCH_SIZE = 1000  # rows per executemany batch
+QUEUE_BATCHES = 4  # batches a worker may decode ahead of the writer
 
+# Columns of the Participation sheet we use: last name, first name, email, check-in time, groups
+ROW_COLUMNS = (2, 3, 4, 9, 11)
+Row = namedtuple('Row', ['email', 'name', 'is_member', 'is_volunteer', 'is_board', 'checkin_time'])
 
-def main(data_dir):
-    """Parse all reports found in DATA_DIR."""
-    data_files = [f for f in listdir(data_dir) if isfile(join(data_dir, f))]
 
-    for entry in data_files:
-        parse_xlsx(join(data_dir, entry), (entry.rsplit(' Participation'))[0])
+# Statement texts are shared by every file so sqlite3's statement cache reuses them
+EVENT_SELECT = 'SELECT 1 FROM events WHERE name=? AND time=?'
+EVENT_INSERT = 'INSERT INTO events VALUES (?,?)'
+STUDENT_UPSERT = ('INSERT INTO students VALUES (?,?,?,?,?) ' +
+                  'ON CONFLICT(email) DO UPDATE SET is_member=excluded.is_member, ' +
+                  'is_volunteer=excluded.is_volunteer, is_board=excluded.is_board')
+RECORD_INSERT = 'INSERT INTO records VALUES (?,?,?,?)'
+RECORD_DELETE = 'DELETE FROM records WHERE event_name=? AND event_time=?'
+EVENT_DELETE = 'DELETE FROM events WHERE name=? AND time=?'
+
+# Rollups of stale events (newly written ones, and those whose attendees changed groups)
+STALE_INSERT = 'INSERT OR IGNORE INTO stale_rollups VALUES (?,?)'
+STALE_DELETE = 'DELETE FROM stale_rollups WHERE event_name=? AND event_time=?'
+ROLLUP_DELETE = 'DELETE FROM rollup WHERE event_name=? AND event_time=?'
+ARRIVAL_ROLLUP_DELETE = 'DELETE FROM arrival_rollup WHERE event_name=? AND event_time=?'
+ROLLUP_REFRESH = '''
+    INSERT OR REPLACE INTO rollup
+    SELECT e.name, e.time,
+           count(CASE WHEN s.is_board THEN 1 END),
+           count(CASE WHEN s.is_board THEN NULL WHEN s.is_volunteer THEN 1 END),
+           count(CASE WHEN s.is_board OR s.is_volunteer THEN NULL WHEN s.is_member THEN 1 END),
+           count(CASE WHEN s.email IS NULL OR s.is_board OR s.is_volunteer OR s.is_member THEN NULL ELSE 1 END)
+    FROM stale_rollups x
+    JOIN events e ON e.name = x.event_name AND e.time = x.event_time
+    LEFT JOIN records r ON r.event_name = e.name AND r.event_time = e.time
+    LEFT JOIN students s ON s.email = r.student_email
+    GROUP BY e.name, e.time'''
+ARRIVAL_ROLLUP_CLEAR = '''
+    DELETE FROM arrival_rollup
+    WHERE (event_name, event_time) IN (SELECT event_name, event_time FROM stale_rollups)'''
+ARRIVAL_ROLLUP_REFRESH = '''
+    INSERT INTO arrival_rollup
+    SELECT e.name, e.time, (r.checkin_epoch - e.epoch) / 60.0, count(*)
+    FROM stale_rollups x
+    JOIN events e ON e.name = x.event_name AND e.time = x.event_time
+    JOIN records r ON r.event_name = e.name AND r.event_time = e.time
+    WHERE r.checkin_epoch IS NOT NULL
+    GROUP BY e.name, e.time, 3'''
+
+# Any change to events, records or group flags moves the data to a new generation,
+# invalidating every memoized selection (see analyses.select)
+GENERATION_BUMP = "UPDATE meta SET value = value + 1 WHERE key = 'generation'"
+
+# The ingest manifest remembers which file produced which event, and what it looked like
+MANIFEST_TOUCH = 'UPDATE manifest SET size=?, mtime=? WHERE path=?'
+MANIFEST_UPSERT = 'INSERT OR REPLACE INTO manifest VALUES (?,?,?,?,?,?)'
+MANIFEST_DELETE = 'DELETE FROM manifest WHERE path=?'
 
 
-def parse_xlsx(file_, event_name):
-    """Parse an xlsx file and insert data into SQLite instance."""
-    conn = sqlite3.connect(DB)
+def main(data_dir, workers=None):
+    """Parse all reports found in DATA_DIR.
+
+    Files whose size and mtime, or failing that content hash, match the ingest manifest
+    are skipped without being opened; changed files replace their event's records. When
+    several files describe the same event, the first in path order owns it (see owner).
+    Files no longer on disk are dropped from the manifest, but their events are kept.
+    Workbooks are decoded by a pool of WORKERS processes (one per core by default), or
+    by this process when WORKERS is 1. Rows are streamed to the writer in batches either
+    way, so memory use does not grow with sheet size. They are written in file name order
+    over one connection in a single transaction; the resulting database is the same for
+    any number of workers.
+    """
+    data_files = sorted(f for f in listdir(data_dir) if isfile(join(data_dir, f)))
+
+    conn = db.connect()
     cur = conn.cursor()
+    start = perf_counter()
+
+    cur.execute('SELECT path, size, mtime, hash, event_name, event_time FROM manifest')
+    manifest = {entry[0]: entry[1:] for entry in cur.fetchall()}
+    # the files that describe each event, as far as the manifest knows, and which owned it
+    claimants = defaultdict(set)
+    for path, known in manifest.items():
+        claimants[tuple(known[3:])].add(path)
+    owners = {event_info: min(paths) for event_info, paths in claimants.items()}
+
+    # (event_info, path, whether path changed) of claims given up, to hand to the next claimant
+    released = []
+    for path, known in manifest.items():
+        if not isfile(path):
+            cur.execute(MANIFEST_DELETE, [path])
+            claimants[tuple(known[3:])].discard(path)
+            released.append((tuple(known[3:]), path, False))
+
+    # (path, event name, size, mtime, hash) of every new or changed file
+    pending = []
+    for entry in data_files:
+        path = abspath(join(data_dir, entry))
+        stats = stat(path)
+        known = manifest.get(path)
+        if known is not None and known[:2] == (stats.st_size, stats.st_mtime):
+            continue
+        digest = file_hash(path)
+        if known is not None and known[2] == digest:
+            cur.execute(MANIFEST_TOUCH, [stats.st_size, stats.st_mtime, path])
+            continue
+        pending.append((path, (entry.rsplit(' Participation'))[0],
+                        stats.st_size, stats.st_mtime, digest))
+
+    # A single worker streams each sheet straight into the database instead, and with
+    # nothing to decode, no worker processes are started at all
+    pool = manager = None
+    if workers != 1 and pending:
+        from concurrent.futures import ProcessPoolExecutor
+        from multiprocessing import Manager
+        pool = ProcessPoolExecutor(workers)
+        manager = Manager()
+
+    loaded = 0
+    written = set()
+    try:
+        with conn:
+            files, event_names = [f[0] for f in pending], [f[1] for f in pending]
+            if pool:
+                queues = [manager.Queue(QUEUE_BATCHES) for _ in range(2 * (workers or cpu_count()))]
+                parsed_files = decode_pooled(pool, queues, files, event_names)
+            else:
+                parsed_files = map(stream_xlsx, files, event_names)
+            for (path, event_name, size, mtime, digest), parsed in zip(pending, parsed_files):
+                event_info = tuple(parsed[0])
+                known = manifest.get(path)
+                if known is not None and tuple(known[3:]) != event_info:
+                    # the file now describes a different event
+                    claimants[tuple(known[3:])].discard(path)
+                    released.append((tuple(known[3:]), path, True))
+                claimants[event_info].add(path)
+                if owner(claimants, event_info) == path:
+                    loaded += write_event(cur, *parsed)
+                    written.add(event_info)
+                else:
+                    print('{}: {} is already loaded from {}, skipped'.format(
+                        path, event_info, owner(claimants, event_info)), file=stderr)
+                    for row in parsed[1]:
+                        pass  # drained all the same, so that its worker can move on
+                cur.execute(MANIFEST_UPSERT, [path, size, mtime, digest] + list(event_info))
+
+            for event_info, path, changed in released:
+                if owners.get(event_info) != path or event_info in written:
+                    continue  # its records never came from that file, or are already replaced
+                successor = owner(claimants, event_info)
+                if successor is not None:
+                    loaded += write_event(cur, *stream_xlsx(successor, event_info[0]))
+                    written.add(event_info)
+                elif changed:
+                    delete_event(cur, event_info)
+            refresh_rollups(cur)
+    finally:
+        if pool:
+            manager.shutdown()  # fails the puts of workers still sending, if writing failed
+            pool.shutdown()
+
+    elapsed = perf_counter() - start
+    conn.close()
+    print('Loaded {} rows from {} files in {:.2f}s ({:.0f} rows/sec), {} files unchanged'.format(
+        loaded, len(pending), elapsed, loaded / elapsed if elapsed else 0,
+        len(data_files) - len(pending)))
+
+
+def owner(claimants, event_info):
+    """Return the first path, in sorted order, of the files describing event_info, or None.
+
+    claimants maps events to the paths of their files. The event's records are that
+    file's, whichever of its files changed last.
+    """
+    return min(claimants.get(event_info, ()), default=None)
+
+
+def file_hash(path):
+    """Return the hex SHA-256 digest of a file's contents."""
+    digest = sha256()
+    with open(path, 'rb') as file_:
+        for block in iter(lambda: file_.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def parse_xlsx(file_, event_name, cur=None):
+    """Parse an xlsx file and insert data into SQLite instance.
+
+    If cur is given, rows are written through it and committing is left to the caller;
+    otherwise the file is loaded over its own connection and committed.
+    Returns the number of attendance records inserted.
+    """
+    if cur is None:
+        conn = db.connect()
+        with conn:
+            loaded = parse_xlsx(file_, event_name, conn.cursor())
+        conn.close()
+        return loaded
+
+    loaded = write_event(cur, *stream_xlsx(file_, event_name))
+    refresh_rollups(cur)
+    return loaded
+
+
+def decode_pooled(pool, queues, files, event_names):
+    """Yield the (event_info, rows) of files in order, as decoded by send_xlsx on pool.
 
-    sheet = (xlrd.open_workbook(file_)).sheet_by_name('Participation')
+    Each file in flight sends its rows through one of queues, so at most len(queues)
+    files are decoded ahead of the writer, each at most QUEUE_BATCHES batches ahead.
+    rows must be exhausted before the next file is requested.
+    """
+    futures = {}
 
-    # 2D list of cells, excluding label row
-    rows = [sheet.row_slice(i + 1) for i in range(sheet.nrows - 1)]
+    def submit(i):
+        if i < len(files):
+            futures[i] = pool.submit(send_xlsx, files[i], event_names[i], queues[i % len(queues)])
 
-    # check if event is already in db
-    # if so, return
-    # if not, add name and date of event to db and continue
-    time = rows[0][0].value
-    time = (datetime.strptime(time, '%Y-%m-%d %I:%M %p')).isoformat()
-    event_info = [event_name, time]
-    cur.execute('SELECT * FROM events WHERE name=? AND time=?',
-                event_info)
+    for i in range(len(queues)):
+        submit(i)
+    for i in range(len(files)):
+        queue, future = queues[i % len(queues)], futures.pop(i)
+        yield receive(queue, future), iter_batches(queue, future)
+        submit(i + len(queues))  # the queue is free again once rows are exhausted
+
+
+def send_xlsx(file_, event_name, queue):
+    """Decode an xlsx file in a worker, putting its event_info, its rows in batches, then None."""
+    event_info, rows = stream_xlsx(file_, event_name)
+    queue.put(event_info)
+    for batch in iter(lambda: list(islice(rows, BATCH_SIZE)), []):
+        queue.put(batch)
+    queue.put(None)
+
+
+def receive(queue, future):
+    """Return the next item send_xlsx puts on queue, raising its error instead if it fails."""
+    while True:
+        try:
+            return queue.get(timeout=.1)
+        except Empty:
+            if future.done() and future.exception() is not None:
+                raise future.exception()
+
+
+def iter_batches(queue, future):
+    """Yield the rows send_xlsx sends through queue."""
+    for batch in iter(lambda: receive(queue, future), None):
+        yield from batch
+
+
+def stream_xlsx(file_, event_name):
+    """Open an xlsx file, returning its event_info and a generator of its rows as Row."""
+    import xlrd  # only needed by ingest, not by the report side, which imports loader for DB
+    book = xlrd.open_workbook(file_, on_demand=True)
+    sheet = book.sheet_by_name('Participation')
+    event_info = (event_name, iso_time(sheet.cell_value(1, 0)))
+    return event_info, iter_rows(book, sheet)
+
+
+def iter_rows(book, sheet):
+    """Yield a Row for every row of sheet, excluding the label row, then release book."""
+    for i in range(1, sheet.nrows):
+        last_name, first_name, email, checkin_time, groups = (
+            sheet.cell_value(i, col) for col in ROW_COLUMNS)
+        yield Row(email,  # this is a unique ID
+                  '{} {}'.format(first_name, last_name),
+                  *group_flags(groups),
+                  checkin_time=iso_time(checkin_time) if checkin_time != '' else None)  # None: manual
+    book.release_resources()
+
+
+@lru_cache(maxsize=4096)
+def iso_time(value):
+    """Convert a sheet timestamp to ISO 8601; check-ins share minutes, so this is cached."""
+    return (datetime.strptime(value, '%Y-%m-%d %I:%M %p')).isoformat()
+
+
+@lru_cache(maxsize=256)
+def group_flags(value):
+    """Convert a sheet's group list to (is_member, is_volunteer, is_board) flags."""
+    group_names = value.split(', ')
+    return (1 if ('General Members' in group_names) else 0,
+            1 if ('CSO Pillar Volunteers' in group_names) else 0,
+            1 if ('CSO Board' in group_names) else 0)
+
+
+def write_event(cur, event_info, rows):
+    """Insert an event decoded by stream_xlsx through cur, replacing any records it already has.
+
+    rows may be any iterable of Row; it is consumed in batches of BATCH_SIZE.
+    The event's rollups are marked stale; call refresh_rollups before committing.
+    Returns the number of attendance records inserted.
+    """
+    cur.execute(EVENT_SELECT, event_info)
     if cur.fetchall() == []:
-        cur.execute('INSERT INTO events VALUES (?,?)', event_info)
+        cur.execute(EVENT_INSERT, event_info)
     else:
-        return
-
-    for row in rows:
-        # First get student's information
-        name = '{} {}'.format(row[3].value, row[2].value)  # first last
-        email = row[4].value  # this is a unique ID
-        group_names = (row[11].value).split(', ')
-        groups = [1 if ('General Members' in group_names) else 0,
-                  1 if ('CSO Pillar Volunteers' in group_names) else 0,
-                  1 if ('CSO Board' in group_names) else 0]
-
-        # Create or update record of this student
-        cur.execute('SELECT * FROM students WHERE email=?', [email])
-        if cur.fetchall() == []:
-            cur.execute('INSERT INTO students VALUES (?,?,?,?,?)',
-                        ([email, name] + groups))
-        else:
-            cur.execute('UPDATE students SET is_member=?, is_volunteer=?, ' +
-                        'is_board=? WHERE email=?', groups + [email])
-
-        # Move on to recording this attendance instance
-        checkin_time = row[9].value
-        if checkin_time == '':
-            checkin_time = 'Manual'
-        else:
-            checkin = datetime.strptime(checkin_time, '%Y-%m-%d %I:%M %p')
-            checkin_time = checkin.isoformat()
-
-        cur.execute('INSERT INTO records VALUES (?,?,?,?)',
-                    event_info + [email, checkin_time])
-
-    conn.commit()
-    conn.close()
-    return
+        cur.execute(RECORD_DELETE, event_info)
+    cur.execute(STALE_INSERT, event_info)
+
+    rows = iter(rows)
+    loaded = 0
+    for batch in iter(lambda: list(islice(rows, BATCH_SIZE)), []):
+        # Create or update records of these students, then record the attendance instances
+        cur.executemany(STUDENT_UPSERT, [row[:5] for row in batch])
+        cur.executemany(RECORD_INSERT, [event_info + (row.email, row.checkin_time) for row in batch])
+        loaded += len(batch)
+    return loaded
+
+
+def delete_event(cur, event_info):
+    """Remove an event, all of its records and its rollups through cur."""
+    cur.execute(RECORD_DELETE, event_info)
+    cur.execute(EVENT_DELETE, event_info)
+    cur.execute(ROLLUP_DELETE, event_info)
+    cur.execute(ARRIVAL_ROLLUP_DELETE, event_info)
+    cur.execute(STALE_DELETE, event_info)
+    cur.execute(GENERATION_BUMP)
+
+
+def refresh_rollups(cur):
+    """Recompute the rollups of every stale event through cur, then clear the stale marks.
+
+    Events are marked stale by write_event, and by a trigger whenever an attendee's group flags change;
+    if any are, the data generation is bumped too.
+    """
+    cur.execute(GENERATION_BUMP + ' AND EXISTS (SELECT 1 FROM stale_rollups)')
+    cur.execute(ROLLUP_REFRESH)
+    cur.execute(ARRIVAL_ROLLUP_CLEAR)
+    cur.execute(ARRIVAL_ROLLUP_REFRESH)
+    cur.execute('DELETE FROM stale_rollups')
+
 
 if __name__ == "__main__":
     if len(argv) == 2:
@@ -0,0 +1,125 @@
+"""Stream the classified emails of event attendees from the database into mailing lists.
+
+Addresses come from a single query, in which SQLite itself classifies each attendee,
+drops duplicates and sorts, and flow through generators to one file per category or to
+stdout as CSV. Memory use stays the same however many addresses a selection has.
+"""
+from os import path
+import csv
+import os
+import sys
+import analyses
+import db
+import eventselector
+import instrument
+
+# an attendee's category, as analyses.classify decides it
+CATEGORY = ("CASE WHEN s.is_board THEN 'Board' WHEN s.is_volunteer THEN 'Volunteers' " +
+            "WHEN s.is_member THEN 'Members' ELSE 'Nonmembers' END")
+CATEGORIES = tuple(sorted(analyses.CATEGORIES[1:]))  # in the order they are sorted
+OVERLAPS = (('a_and_b', 'INTERSECT'), ('a_not_b', 'EXCEPT'), ('b_not_a', 'EXCEPT'))
+
+
+def email_query(names=[], dates=[], date_range=(), distinct=True):
+    """Build a query of the (category, email) of attendees of a selection of events, and its parameters.
+
+    With distinct, each attendee appears once; otherwise once for every event they attended.
+    """
+    selection = eventselector.compile_selection(names, dates, date_range)
+    return ('SELECT ' + ('DISTINCT ' if distinct else '') + CATEGORY + ' AS category, ' +
+            'r.student_email AS email ' +
+            'FROM records r JOIN students s ON s.email = r.student_email ' +
+            'WHERE (r.event_name, r.event_time) IN ' +
+            '(SELECT name, time FROM events WHERE ' + selection.where + ')',
+            list(selection.params))
+
+
+def overlap_query(overlap, events_data_a, events_data_b):
+    """Build a query of the (category, email) of the distinct attendees in one overlap of two selections.
+
+    overlap is 'a_and_b', 'a_not_b' or 'b_not_a', as in analyses.compare_attendees.
+    """
+    operator = dict(OVERLAPS)[overlap]
+    if overlap == 'b_not_a':
+        events_data_a, events_data_b = events_data_b, events_data_a
+    query_a, params_a = email_query(*events_data_a)
+    query_b, params_b = email_query(*events_data_b)
+    return query_a + ' ' + operator + ' ' + query_b, params_a + params_b
+
+
+def stream(query, params, ordered=True):
+    """Yield the (category, email) rows of an email query, by category and email if ordered.
+
+    Rows are read one at a time, through a connection borrowed from db's pool until the
+    generator is exhausted or closed.
+    """
+    if ordered:
+        query += ' ORDER BY category, email'
+    with db.connection() as conn:
+        yield from conn.execute(query, params)
+
+
+def selection_emails(events_data, distinct=True, ordered=True):
+    """Yield the (category, email) of the attendees of events_data, a (names, dates, daterange) triple."""
+    return stream(*email_query(*events_data, distinct=distinct), ordered=ordered)
+
+
+def comparison_emails(events_data_a, events_data_b, ordered=True):
+    """Yield the (overlap, category, email) of the distinct attendees of two selections, overlap by overlap."""
+    for overlap, operator in OVERLAPS:
+        for category, email in stream(*overlap_query(overlap, events_data_a, events_data_b), ordered):
+            yield overlap, category, email
+
+
+def write_lists(rows, directory, groups):
+    """Write rows, tuples ending in an email, to one file per group of the fields before it.
+
+    Files are named after those fields, as in board.txt or a_not_b-board.txt, and one is
+    created for each of groups, even if no rows fall in it. Returns the number of rows.
+    """
+    os.makedirs(directory, exist_ok=True)
+    files = {}
+    written = 0
+    try:
+        for group in groups:
+            files[group] = open(path.join(directory, '-'.join(group).lower() + '.txt'), 'w')
+        for row in rows:
+            files[row[:-1]].write(row[-1] + '\n')
+            written += 1
+    finally:
+        for mailing_list in files.values():
+            mailing_list.close()
+    return written
+
+
+def write_csv(rows, header, out=None):
+    """Write rows as CSV under a header row to out, stdout by default, returning the number of rows."""
+    writer = csv.writer(out or sys.stdout)
+    writer.writerow(header)
+    written = 0
+    for row in rows:
+        writer.writerow(row)
+        written += 1
+    return written
+
+
+@instrument.traced
+def export(destination, events_data, events_data_vs=None, distinct=True, ordered=True):
+    """Export the emails of a selection, or the overlaps of two, to destination.
+
+    destination is a directory, which gets one file per category (and overlap), or '-' for
+    CSV on stdout. distinct=False lists an attendee once per event of a single selection;
+    overlaps are always distinct. Returns the number of addresses written.
+    """
+    if events_data_vs is None:
+        rows = selection_emails(events_data, distinct, ordered)
+        header = ['category', 'email']
+        groups = [(category,) for category in CATEGORIES]
+    else:
+        rows = comparison_emails(events_data, events_data_vs, ordered)
+        header = ['overlap', 'category', 'email']
+        groups = [(overlap, category) for overlap, operator in OVERLAPS for category in CATEGORIES]
+
+    if destination == '-':
+        return write_csv(rows, header)
+    return write_lists(rows, destination, groups)
@@ -0,0 +1,208 @@
+"""Columnar in-memory attendance matrix, for fast analytics over many event selections.
+
+Students and events are interned to integer IDs. Attendance is held in compressed sparse row
+form: the records of event i are indices[indptr[i]:indptr[i + 1]], each the ID of a student,
+alongside the arrival delta of that record. Each student's category is a uint8 code.
+
+AttendanceMatrix loads all of this once, from the records and students tables; its views of
+event selections answer the same questions as analyses.Attendance with vectorized reductions
+and set operations, and can stand in for it anywhere, including in orchestrator reports.
+
+Run directly to load the database and report the matrix's memory footprint.
+"""
+from sys import getsizeof
+from time import perf_counter
+import numpy as np
+import analyses
+import db
+import instrument
+
+CODES = {category: code for code, category in enumerate(analyses.CATEGORIES[1:])}
+RECORDS_QUERY = ('SELECT r.event_name, r.event_time, r.student_email, ' +
+                 '(r.checkin_epoch - e.epoch) / 60.0 ' +
+                 'FROM records r ' +
+                 'JOIN events e ON e.name = r.event_name AND e.time = r.event_time ' +
+                 'JOIN students s ON s.email = r.student_email')
+
+
+def category_counts(codes):
+    """Count an array of category codes into a CATEGORIES-keyed dictionary of ints."""
+    counts = np.bincount(codes, minlength=len(CODES))
+    return counts_dict(counts)
+
+
+def counts_dict(counts):
+    """Convert an array of per-code counts to a CATEGORIES-keyed dictionary of ints."""
+    attendee_counts = {category: int(counts[code]) for category, code in CODES.items()}
+    attendee_counts['All'] = int(counts.sum())
+    return attendee_counts
+
+
+class AttendanceMatrix(object):
+    """Attendance of every event by every student, interned and held in NumPy arrays."""
+
+    def __init__(self, cur=None):
+        """Load the matrix through cur if given, or a pooled connection otherwise."""
+        if cur is None:
+            with db.connection() as conn:
+                self.load(conn.cursor())
+        else:
+            self.load(cur)
+
+    @instrument.traced
+    def load(self, cur):
+        """Read students, events and records through cur, replacing the matrix's contents.
+
+        They are read in one transaction, unless cur's connection is in one already, so that
+        all three come from the same snapshot of the database however ingest changes it meanwhile.
+        """
+        if cur.connection.in_transaction:
+            return self.read(cur)
+        cur.execute('BEGIN')
+        try:
+            self.read(cur)
+        finally:
+            cur.execute('COMMIT')
+
+    def read(self, cur):
+        """Read students, events and records through cur; see load."""
+        cur.execute('SELECT email, is_member, is_volunteer, is_board FROM students')
+        students = cur.fetchall()
+        self.emails = [row[0] for row in students]
+        self.student_ids = {email: i for i, email in enumerate(self.emails)}
+        self.category = np.fromiter((CODES[analyses.classify(*row[1:])] for row in students),
+                                    dtype=np.uint8, count=len(students))
+
+        cur.execute('SELECT name, time FROM events')
+        self.events = cur.fetchall()
+        self.event_ids = {event: i for i, event in enumerate(self.events)}
+
+        cur.execute(RECORDS_QUERY)
+        records = cur.fetchall()
+        event_of = np.fromiter((self.event_ids[record[:2]] for record in records),
+                               dtype=np.int32, count=len(records))
+        order = np.argsort(event_of, kind='stable')
+        self.indices = np.fromiter((self.student_ids[record[2]] for record in records),
+                                   dtype=np.int32, count=len(records))[order]
+        self.deltas = np.fromiter((np.nan if record[3] is None else record[3]  # manual check-in
+                                   for record in records), dtype=float, count=len(records))[order]
+        self.indptr = np.zeros(len(self.events) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(event_of, minlength=len(self.events)), out=self.indptr[1:])
+
+    def view(self, events_list):
+        """Return a MatrixAttendance of events_list, a list of (name, time) events."""
+        return MatrixAttendance(self, events_list)
+
+    def nbytes(self):
+        """Return the approximate memory footprint of the matrix, in bytes."""
+        arrays = (self.category, self.indices, self.deltas, self.indptr)
+        return (sum(array.nbytes for array in arrays) +
+                getsizeof(self.emails) + sum(getsizeof(email) for email in self.emails) +
+                getsizeof(self.student_ids) +
+                getsizeof(self.events) + sum(getsizeof(event) for event in self.events) +
+                getsizeof(self.event_ids))
+
+
+class MatrixAttendance(object):
+    """View of the attendance of one group of events in an AttendanceMatrix.
+
+    Offers the interface of analyses.Attendance; events unknown to the matrix count as empty.
+    """
+
+    def __init__(self, matrix, events_list):
+        self.matrix = matrix
+        self.events = [tuple(event[:2]) for event in events_list]
+        ids = np.array([matrix.event_ids.get(event, -1) for event in self.events], dtype=np.int64)
+
+        # positions in matrix.indices of the records of each event, concatenated
+        starts = np.where(ids >= 0, matrix.indptr[ids], 0)
+        self.lengths = np.where(ids >= 0, matrix.indptr[ids + 1] - starts, 0)
+        offsets = np.cumsum(self.lengths) - self.lengths
+        self.positions = (np.repeat(starts - offsets, self.lengths) +
+                          np.arange(self.lengths.sum(), dtype=np.int64))
+
+        self.attendees = matrix.indices[self.positions]
+        self.distinct = np.unique(self.attendees)
+
+    def counts(self, distinct_only=False, average_attendance=False, average_events=False):
+        """Return a dictionary of attendee counts per category; see analyses.count_attendees.
+
+        Averages are 0 for categories without attendees.
+        """
+        analyses.check_options(distinct_only, average_attendance, average_events)
+
+        attendee_distinct = category_counts(self.matrix.category[self.distinct])
+        if distinct_only:
+            return attendee_distinct
+
+        attendee_counts = category_counts(self.matrix.category[self.attendees])
+        if average_attendance:
+            for field in attendee_counts:
+                attendee_counts[field] = attendee_counts[field] / len(self.events) if self.events else 0
+
+        if average_events:
+            for field in attendee_counts:
+                attendee_counts[field] = (attendee_counts[field] / attendee_distinct[field]
+                                          if attendee_distinct[field] else 0)
+
+        return attendee_counts
+
+    def event_counts(self):
+        """Return a list of (event, counts) pairs, one per event of the view."""
+        event_of = np.repeat(np.arange(len(self.events)), self.lengths)
+        codes = self.matrix.category[self.attendees].astype(np.int64)
+        counts = np.bincount(event_of * len(CODES) + codes, minlength=len(self.events) * len(CODES))
+        return [(event, counts_dict(row))
+                for event, row in zip(self.events, counts.reshape(-1, len(CODES)))]
+
+    def emails(self):
+        """Return a dictionary of lists of distinct attendee emails per category."""
+        return self.email_lists(self.distinct)
+
+    def email_lists(self, student_ids):
+        """Return a dictionary of lists of the emails of student_ids per category."""
+        emails = self.matrix.emails
+        codes = self.matrix.category[student_ids]
+        email_lists = {'All': [emails[i] for i in student_ids]}
+        for category, code in CODES.items():
+            email_lists[category] = [emails[i] for i in student_ids[codes == code]]
+        return email_lists
+
+    def arrival_deltas(self):
+        """Return a NumPy array of arrival times, in minutes relative to the event start time."""
+        deltas = self.matrix.deltas[self.positions]
+        return deltas[~np.isnan(deltas)]
+
+    @property
+    def students(self):
+        """Dictionary mapping every distinct attendee to their category, as in Attendance."""
+        categories = analyses.CATEGORIES[1:]
+        return {self.matrix.emails[i]: categories[code]
+                for i, code in zip(self.distinct, self.matrix.category[self.distinct])}
+
+    @instrument.traced
+    def compare(self, other):
+        """Compare with another view of the same matrix; see analyses.compare_attendees."""
+        if other.matrix is not self.matrix:
+            raise ValueError('views must be of the same matrix')
+        attendees_a = self.emails()
+        attendees_b = other.emails()
+
+        comparison = {}
+        comparison['a_or_b'] = {category: attendees_a[category] + attendees_b[category]
+                                for category in analyses.CATEGORIES}
+        comparison['a_and_b'] = self.email_lists(
+            np.intersect1d(self.distinct, other.distinct, assume_unique=True))
+        comparison['a_not_b'] = self.email_lists(
+            np.setdiff1d(self.distinct, other.distinct, assume_unique=True))
+        comparison['b_not_a'] = self.email_lists(
+            np.setdiff1d(other.distinct, self.distinct, assume_unique=True))
+        return comparison
+
+
+if __name__ == '__main__':
+    start = perf_counter()
+    matrix = AttendanceMatrix()
+    print('Loaded {} students, {} events and {} records in {:.2f}s, using {:.1f} MiB'.format(
+        len(matrix.emails), len(matrix.events), len(matrix.indices), perf_counter() - start,
+        matrix.nbytes() / 2 ** 20))
@@ -2,327 +2,385 @@
 
 Interfaces with analyses, eventselector, plotter, texgenerator, gui, cli- basically everything.
 """
-import loader
 import analyses
+import backends
+import db
 import eventselector
+import instrument
 import plotter
 import texvar
+import typeset
 
-import sqlite3
-import subprocess
+import shutil
+import tempfile
+from contextlib import contextmanager
 from datetime import datetime
 import os
 
 
-def standard_report(names=[], dates=[], daterange=(), include_emails=False, verbose=False):
-    """Generate a standard report on a single group of events.
+CATEGORY_VARS = (('all', 'All'), ('board', 'Board'), ('volunteers', 'Volunteers'),
+                 ('members', 'Members'), ('nonmembers', 'Nonmembers'))
+# tex_vars prefix, measure in the metrics, and its format (None leaves counts as they are)
+MEASURE_VARS = (('distinct', 'distinct', None), ('total', 'total', None),
+                ('average', 'average_attendance', '%.3f'), ('event', 'average_events', '%.3f'))
+VENN_TITLES = {'All': 'All', 'Board': 'Board Members', 'Volunteers': 'Volunteers',
+               'Members': 'Members', 'Nonmembers': 'Nonmembers'}
+OVERLAPS = ('a_and_b', 'a_not_b', 'b_not_a')
+FORMATS = ('pdf',) + tuple(backends.BACKENDS)
 
-    Takes in a list of names, a list of dates, and a 2-tuple containing a start and end date.
+
+def bar_chart_rows(events):
+    """Return the stacked bar chart rows for the events of a group's metrics, latest event first."""
+    events_attendance = []
+    for event in events:
+        event_time = datetime.strptime(event['time'], '%Y-%m-%dT%H:%M:%S')
+        event_str = event['name'] + '\n' + event_time.date().isoformat()
+        counts = event['counts']
+        events_attendance.append(
+            [event_str, counts['Board'], counts['Volunteers'], counts['Members'], counts['Nonmembers']]
+        )
+
+    return events_attendance[::-1]  # reverse the resulting list
+
+
+def arrival_deltas(arrivals):
+    """Expand an arrival time histogram of the metrics back into an array of arrival deltas."""
+    import numpy as np
+    deltas = np.array([delta for delta, attendees in arrivals], dtype=float)
+    return np.repeat(deltas, [attendees for delta, attendees in arrivals])
+
+
+@instrument.traced
+def load_group(cur, names=[], dates=[], daterange=(), snapshots=None, matrix=None):
+    """Select a group of events, returning the events list and its attendance snapshot.
+
+    Snapshots are memoized in the database by analyses.select, or with a matrix, a
+    matrix.AttendanceMatrix, are views of it instead. If a snapshots dictionary is given,
+    they are also shared through it, keyed by the selection, so that every report on the
+    same selection reuses the same snapshot.
     """
-    conn = sqlite3.connect(loader.DB)
-    cur = conn.cursor()
-    events_query, query_vars = eventselector.build_query(names, dates, daterange)
-    cur.execute(events_query, query_vars)
+    if snapshots is not None:
+        key = analyses.memo_key(names, dates, daterange)
+        if key not in snapshots:
+            snapshots[key] = load_group(cur, names, dates, daterange, matrix=matrix)
+        return snapshots[key]
+
+    if matrix is None:
+        return analyses.select(cur, names, dates, daterange)
+    cur.execute(*eventselector.build_query(names, dates, daterange))
     events_list = cur.fetchall()
+    return events_list, matrix.view(events_list)
 
-    tex_vars = {}
 
-    tex_vars['groupname'] = eventselector.name_group(names, dates, daterange)
-
-    arrival_times = analyses.get_arrival_deltas(events_list)
-    plotter.arrival_chart(arrival_times, 'arrival_times.png')
-    tex_vars['arrivalchart'] = './.working/arrival_times.png'
-
-    distinct_attend = analyses.count_attendees(events_list, distinct_only=True)
-    tex_vars['distinctall'] = distinct_attend['All']
-    tex_vars['distinctboard'] = distinct_attend['Board']
-    tex_vars['distinctvolunteers'] = distinct_attend['Volunteers']
-    tex_vars['distinctmembers'] = distinct_attend['Members']
-    tex_vars['distinctnonmembers'] = distinct_attend['Nonmembers']
-
-    total_attend = analyses.count_attendees(events_list)
-    tex_vars['totalall'] = total_attend['All']
-    tex_vars['totalboard'] = total_attend['Board']
-    tex_vars['totalvolunteers'] = total_attend['Volunteers']
-    tex_vars['totalmembers'] = total_attend['Members']
-    tex_vars['totalnonmembers'] = total_attend['Nonmembers']
-
-    average_attend = analyses.count_attendees(events_list, average_attendance=True)
-    tex_vars['averageall'] = "%.3f" % average_attend['All']
-    tex_vars['averageboard'] = "%.3f" % average_attend['Board']
-    tex_vars['averagevolunteers'] = "%.3f" % average_attend['Volunteers']
-    tex_vars['averagemembers'] = "%.3f" % average_attend['Members']
-    tex_vars['averagenonmembers'] = "%.3f" % average_attend['Nonmembers']
-
-    event_attend = analyses.count_attendees(events_list, average_events=True)
-    tex_vars['eventall'] = "%.3f" % event_attend['All']
-    tex_vars['eventboard'] = "%.3f" % event_attend['Board']
-    tex_vars['eventvolunteers'] = "%.3f" % event_attend['Volunteers']
-    tex_vars['eventmembers'] = "%.3f" % event_attend['Members']
-    tex_vars['eventnonmembers'] = "%.3f" % event_attend['Nonmembers']
+def extension(output_format):
+    """Return the file extension of reports in output_format, 'pdf' or one of backends.BACKENDS."""
+    if output_format == 'pdf':
+        return '.pdf'
+    if output_format not in backends.BACKENDS:
+        raise ValueError('unknown output format: {}'.format(output_format))
+    return backends.BACKENDS[output_format][0]
 
-    if include_emails:
-        tex_vars['emailboard'] = ''
-        tex_vars['emailvolunteers'] = ''
-        tex_vars['emailmembers'] = ''
-        tex_vars['emailnonmembers'] = ''
-
-        email_list = analyses.list_emails(events_list)
-        for email in email_list['Board']:
-            tex_vars['emailboard'] += email + '\n'
-        for email in email_list['Volunteers']:
-            tex_vars['emailvolunteers'] += email + '\n'
-        for email in email_list['Members']:
-            tex_vars['emailmembers'] += email + '\n'
-        for email in email_list['Nonmembers']:
-            tex_vars['emailnonmembers'] += email + '\n'
 
-    events_attendance = []
-    events_list = sorted(events_list, key=lambda x: x[1])
-    for event in events_list:
-        event_time = datetime.strptime(event[1], '%Y-%m-%dT%H:%M:%S')
-        event_str = event[0] + '\n' + event_time.date().isoformat()
-        events_attendance.append((event_str, analyses.count_attendees([event])))
-
-    events_attendance = [
-        [e[0]] +
-        [e[1]['Board']] +
-        [e[1]['Volunteers']] +
-        [e[1]['Members']] +
-        [e[1]['Nonmembers']]
-        for e in events_attendance
-    ][::-1]  # reverse the resulting list
-
-    plotter.bar_chart(events_attendance, 'attendance.png',
-                      title='Event Attendance at ' + tex_vars['groupname'])
-    tex_vars['attendancechart'] = './.working/attendance.png'
-
-    texvar.write_tex_vars(tex_vars)
-    if verbose:
-        subprocess.run('pdflatex -output-directory Reports Templates/standard.tex', shell=True)
+def check_jobname(jobname):
+    """Raise ValueError unless jobname is a plain file name, which cannot point outside its directory."""
+    if os.sep in jobname or (os.altsep and os.altsep in jobname) or '..' in jobname:
+        raise ValueError('report name must not contain a path: {}'.format(jobname))
+
+
+@contextmanager
+def scratch_dir(jobname):
+    """Lend a private working directory to one run of report jobname for the duration of a with block.
+
+    Every run gets a fresh directory, so runs of the same report from several threads,
+    processes or command line invocations never share charts or vars.tex. It is removed
+    afterwards, whether the report was generated or not, so that failed runs of a
+    long-running process do not pile up.
+    """
+    check_jobname(jobname)
+    os.makedirs(plotter.WORK_DIR, exist_ok=True)
+    work_dir = os.path.relpath(tempfile.mkdtemp(prefix=jobname + '-', dir=plotter.WORK_DIR))
+    try:
+        yield work_dir
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def chart_file(work_dir, filename):
+    """Return the plotter filename of a report's chart, and the path LaTeX should read it from."""
+    return filename, './' + os.path.normpath(os.path.join(work_dir, filename))
+
+
+@instrument.traced
+def compile_report(template, jobname, work_dir, output, verbose=False, key=None, latex_pool=None):
+    """Typeset a template over the vars.tex in work_dir, moving the PDF to output.
+
+    pdflatex runs on latex_pool if given. The PDF is stored in typeset's cache under key,
+    if given. Returns output.
+    """
+    if latex_pool is None:
+        pdf = typeset.run_pdflatex(template, jobname, work_dir, verbose)
     else:
-        subprocess.check_output('pdflatex -output-directory Reports Templates/standard.tex', shell=True)
-    os.remove('./Reports/standard.aux')
-    os.remove('./Reports/standard.log')
-    conn.close()
+        pdf = latex_pool.submit(typeset.run_pdflatex, template, jobname, work_dir, verbose).result()
+    if key is not None:
+        typeset.store(key, pdf)
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    # a rename where possible, so readers of output never see half a PDF
+    shutil.move(pdf, output)
+    return output
 
 
-def comparison_report(events_data_a, events_data_b, include_emails=False, verbose=False):
-    """Compare two groups of events.
+def build_report(template, jobname, work_dir, output, tex_vars, charts, verbose=False, pool=None,
+                 latex_pool=None):
+    """Draw a report's charts, write its vars.tex and typeset it into output.
 
-    events_data_* variables should be 3-tuples of format (names, dates, daterange).
-    see docstring on standard_report for further information on these three variables.
+    A report identical to one built before is copied from typeset's cache instead, without
+    drawing or typesetting anything. Returns output.
+    """
+    key = typeset.document_key(template, tex_vars, charts)
+    if typeset.restore(key, output):
+        return output
+
+    # draw every chart concurrently; LaTeX only needs them once they are all written
+    plotter.render_all(charts, pool)
+    texvar.write_tex_vars(tex_vars, os.path.join(work_dir, 'vars.tex'))
+    return compile_report(template, jobname, work_dir, output, verbose, key, latex_pool)
+
+
+def in_order(counts):
+    """Return counts per category with the categories in the fixed order of backends.CATEGORIES."""
+    return {category: counts[category] for category in backends.CATEGORIES}
+
+
+def sorted_emails(email_lists):
+    """Return email lists per category, sorted and in the fixed order of backends.CATEGORIES.
+
+    Snapshots from the database and from a matrix list attendees in different orders, so
+    this keeps a report's metrics, and its typeset cache key, the same either way.
+    """
+    return {category: sorted(email_lists[category]) for category in backends.CATEGORIES}
+
+
+def group_metrics(attendance, names=[], dates=[], daterange=()):
+    """Return the metrics of one group of events, from its attendance snapshot.
+
+    These are the group's name, as in the PDF, and its selection, as names, ISO 8601 dates
+    and a date range; its events in chronological order, each with its attendee
+    counts per category; its distinct and total attendee counts, average attendance and
+    average events attended per category; and a histogram of arrival times, as a list of
+    [minutes after the start, attendees] pairs.
+    """
+    import numpy as np
+    deltas, attendees = np.unique(attendance.arrival_deltas(), return_counts=True)
+    return {
+        'group': eventselector.name_group(names, dates, daterange),
+        'selection': {'names': list(names), 'dates': [date.date().isoformat() for date in dates],
+                      'date_range': [day.date().isoformat() for day in daterange]},
+        'events': [{'name': event[0], 'time': event[1], 'counts': in_order(counts)}
+                   for event, counts in sorted(attendance.event_counts(), key=lambda x: x[0][1])],
+        'distinct': in_order(attendance.counts(distinct_only=True)),
+        'total': in_order(attendance.counts()),
+        'average_attendance': in_order(attendance.counts(average_attendance=True)),
+        'average_events': in_order(attendance.counts(average_events=True)),
+        'arrivals': [[float(delta), int(count)] for delta, count in zip(deltas, attendees)],
+    }
+
+
+@instrument.traced
+def standard_metrics(cur, names=[], dates=[], daterange=(), include_emails=False, snapshots=None,
+                     matrix=None):
+    """Compute the metrics of a standard report, as a JSON-serializable dictionary.
+
+    These are the group_metrics of the selection, and with include_emails, its distinct
+    attendees' emails per category under 'emails'. See standard_report for the arguments.
     """
-    conn = sqlite3.connect(loader.DB)
-    cur = conn.cursor()
+    events_list, attendance = load_group(cur, names, dates, daterange, snapshots, matrix)
+    metrics = dict(group_metrics(attendance, names, dates, daterange), report='standard')
+    if include_emails:
+        metrics['emails'] = sorted_emails(attendance.emails())
+    return metrics
 
-    events_query = eventselector.build_query(*events_data_a)
-    cur.execute(*events_query)
-    events_list_a = cur.fetchall()
 
-    events_query = eventselector.build_query(*events_data_b)
-    cur.execute(*events_query)
-    events_list_b = cur.fetchall()
+def measure_vars(tex_vars, group, side=''):
+    """Add the attendee count tex_vars of a group's metrics, with side between measure and category."""
+    for prefix, measure, number_format in MEASURE_VARS:
+        for suffix, category in CATEGORY_VARS:
+            value = group[measure][category]
+            tex_vars[prefix + side + suffix] = value if number_format is None else number_format % value
 
+
+def standard_tex_vars(metrics, work_dir='.'):
+    """Return the tex_vars of a standard report's metrics, and the chart jobs drawing its images into work_dir."""
     tex_vars = {}
-    tex_vars['groupnamea'] = eventselector.name_group(*events_data_a)
-    tex_vars['groupnameb'] = eventselector.name_group(*events_data_b)
-
-    # Create dictionary entries for numbers of distinct attendees
-    distinct_attend_a = analyses.count_attendees(events_list_a, distinct_only=True)
-    tex_vars['distinctaall'] = distinct_attend_a['All']
-    tex_vars['distinctaboard'] = distinct_attend_a['Board']
-    tex_vars['distinctavolunteers'] = distinct_attend_a['Volunteers']
-    tex_vars['distinctamembers'] = distinct_attend_a['Members']
-    tex_vars['distinctanonmembers'] = distinct_attend_a['Nonmembers']
-    distinct_attend_b = analyses.count_attendees(events_list_b, distinct_only=True)
-    tex_vars['distinctball'] = distinct_attend_b['All']
-    tex_vars['distinctbboard'] = distinct_attend_b['Board']
-    tex_vars['distinctbvolunteers'] = distinct_attend_b['Volunteers']
-    tex_vars['distinctbmembers'] = distinct_attend_b['Members']
-    tex_vars['distinctbnonmembers'] = distinct_attend_b['Nonmembers']
-
-    # Create dictionary entries for total numbers of attendees
-    total_attend_a = analyses.count_attendees(events_list_a)
-    tex_vars['totalaall'] = total_attend_a['All']
-    tex_vars['totalaboard'] = total_attend_a['Board']
-    tex_vars['totalavolunteers'] = total_attend_a['Volunteers']
-    tex_vars['totalamembers'] = total_attend_a['Members']
-    tex_vars['totalanonmembers'] = total_attend_a['Nonmembers']
-    total_attend_b = analyses.count_attendees(events_list_b)
-    tex_vars['totalball'] = total_attend_b['All']
-    tex_vars['totalbboard'] = total_attend_b['Board']
-    tex_vars['totalbvolunteers'] = total_attend_b['Volunteers']
-    tex_vars['totalbmembers'] = total_attend_b['Members']
-    tex_vars['totalbnonmembers'] = total_attend_b['Nonmembers']
-
-    # Create dictionary entries for average number of attendees per event
-    average_attend_a = analyses.count_attendees(events_list_a, average_attendance=True)
-    tex_vars['averageaall'] = "%.3f" % average_attend_a['All']
-    tex_vars['averageaboard'] = "%.3f" % average_attend_a['Board']
-    tex_vars['averageavolunteers'] = "%.3f" % average_attend_a['Volunteers']
-    tex_vars['averageamembers'] = "%.3f" % average_attend_a['Members']
-    tex_vars['averageanonmembers'] = "%.3f" % average_attend_a['Nonmembers']
-    average_attend_b = analyses.count_attendees(events_list_b, average_attendance=True)
-    tex_vars['averageball'] = "%.3f" % average_attend_b['All']
-    tex_vars['averagebboard'] = "%.3f" % average_attend_b['Board']
-    tex_vars['averagebvolunteers'] = "%.3f" % average_attend_b['Volunteers']
-    tex_vars['averagebmembers'] = "%.3f" % average_attend_b['Members']
-    tex_vars['averagebnonmembers'] = "%.3f" % average_attend_b['Nonmembers']
-
-    # Create dictionary entries for the average number of events an attendee has attended
-    event_attend_a = analyses.count_attendees(events_list_a, average_events=True)
-    tex_vars['eventaall'] = "%.3f" % event_attend_a['All']
-    tex_vars['eventaboard'] = "%.3f" % event_attend_a['Board']
-    tex_vars['eventavolunteers'] = "%.3f" % event_attend_a['Volunteers']
-    tex_vars['eventamembers'] = "%.3f" % event_attend_a['Members']
-    tex_vars['eventanonmembers'] = "%.3f" % event_attend_a['Nonmembers']
-    event_attend_b = analyses.count_attendees(events_list_b, average_events=True)
-    tex_vars['eventball'] = "%.3f" % event_attend_b['All']
-    tex_vars['eventbboard'] = "%.3f" % event_attend_b['Board']
-    tex_vars['eventbvolunteers'] = "%.3f" % event_attend_b['Volunteers']
-    tex_vars['eventbmembers'] = "%.3f" % event_attend_b['Members']
-    tex_vars['eventbnonmembers'] = "%.3f" % event_attend_b['Nonmembers']
+    tex_vars['groupname'] = metrics['group']
+
+    arrival_file, tex_vars['arrivalchart'] = chart_file(work_dir, 'arrival_times.png')
+    charts = [('arrival_chart', (arrival_deltas(metrics['arrivals']), arrival_file), {})]
+
+    measure_vars(tex_vars, metrics)
+
+    if 'emails' in metrics:
+        for suffix, category in CATEGORY_VARS[1:]:
+            tex_vars['email' + suffix] = ''.join(email + '\n' for email in metrics['emails'][category])
+
+    attendance_file, tex_vars['attendancechart'] = chart_file(work_dir, 'attendance.png')
+    charts.append(('bar_chart', (bar_chart_rows(metrics['events']), attendance_file),
+                   {'title': 'Event Attendance at ' + tex_vars['groupname']}))
+
+    return tex_vars, [(name, args, dict(kwargs, work_dir=work_dir)) for name, args, kwargs in charts]
+
+
+def standard_vars(cur, names=[], dates=[], daterange=(), include_emails=False, work_dir='.',
+                  snapshots=None, matrix=None):
+    """Compute the tex_vars of a standard report, and the chart jobs drawing its images into work_dir.
+
+    Nothing is drawn or written; see standard_report for the arguments.
+    """
+    metrics = standard_metrics(cur, names, dates, daterange, include_emails, snapshots, matrix)
+    return standard_tex_vars(metrics, work_dir)
+
+
+@instrument.traced
+def standard_report(names=[], dates=[], daterange=(), include_emails=False, verbose=False,
+                    jobname='standard', output=None, conn=None, snapshots=None, pool=None,
+                    matrix=None, latex_pool=None, output_format='pdf'):
+    """Generate a standard report on a single group of events.
+
+    Takes in a list of names, a list of dates, and a 2-tuple containing a start and end date.
+    The report is written to output, Reports/<jobname>.pdf by default, from scratch files in
+    a directory of its own under .working (see scratch_dir).
+    conn, snapshots and pool let batch runs share a connection, attendance snapshots
+    (see load_group) and a chart rendering pool across reports; without conn, the report
+    borrows a connection from db's pool. matrix, a matrix.AttendanceMatrix, serves attendance
+    from memory instead of the database, and latex_pool, an executor, runs pdflatex.
+    output_format picks the kind of report: a 'pdf', or one of the backends; those skip charts
+    and LaTeX altogether, and output may be '-' for stdout. Returns the path of the report.
+    """
+    if conn is None:
+        with db.connection() as conn:  # one pooled read-only connection for the whole report
+            return standard_report(names, dates, daterange, include_emails, verbose, jobname,
+                                   output, conn, snapshots, pool, matrix, latex_pool, output_format)
+
+    check_jobname(jobname)
+    if output is None:
+        output = os.path.join('Reports', jobname + extension(output_format))
+    if output_format != 'pdf':
+        metrics = standard_metrics(conn.cursor(), names, dates, daterange, include_emails, snapshots,
+                                   matrix)
+        return backends.write(output_format, metrics, output)
+
+    with scratch_dir(jobname) as work_dir:
+        tex_vars, charts = standard_vars(
+            conn.cursor(), names, dates, daterange, include_emails, work_dir, snapshots, matrix
+        )
+
+        return build_report('standard', jobname, work_dir, output, tex_vars, charts, verbose, pool,
+                            latex_pool)
+
+
+@instrument.traced
+def comparison_metrics(cur, events_data_a, events_data_b, include_emails=False, snapshots=None,
+                       matrix=None):
+    """Compute the metrics of a comparison report, as a JSON-serializable dictionary.
+
+    These are the group_metrics of both groups, under 'groups' as 'a' and 'b'; the number of
+    distinct attendees per category who came to both groups, only to a and only to b, under
+    'overlap' as 'a_and_b', 'a_not_b' and 'b_not_a'; and with include_emails, their emails
+    under 'emails', the same way. See comparison_report for the arguments.
+    """
+    events_list_a, attendance_a = load_group(cur, *events_data_a, snapshots=snapshots, matrix=matrix)
+    events_list_b, attendance_b = load_group(cur, *events_data_b, snapshots=snapshots, matrix=matrix)
 
     # Compare the overlap / lack thereof of the attendee groups
-    comparison = analyses.compare_attendees(events_list_a, events_list_b)
-    attends_both = comparison['a_and_b']
-    attends_only_a = comparison['a_not_b']
-    attends_only_b = comparison['b_not_a']
-
-    all_venn = []
-    all_venn += [len(attends_only_a['All'])]
-    all_venn += [len(attends_only_b['All'])]
-    all_venn += [len(attends_both['All'])]
-    # all_venn = set(all_venn)
-
-    board_venn = []
-    board_venn += [len(attends_only_a['Board'])]
-    board_venn += [len(attends_only_b['Board'])]
-    board_venn += [len(attends_both['Board'])]
-    # board_venn = set(board_venn)
-
-    volunteers_venn = []
-    volunteers_venn += [len(attends_only_a['Volunteers'])]
-    volunteers_venn += [len(attends_only_b['Volunteers'])]
-    volunteers_venn += [len(attends_both['Volunteers'])]
-    # volunteers_venn = set(volunteers_venn)
-
-    members_venn = []
-    members_venn += [len(attends_only_a['Members'])]
-    members_venn += [len(attends_only_b['Members'])]
-    members_venn += [len(attends_both['Members'])]
-    # members_venn = set(members_venn)
-
-    nonmembers_venn = []
-    nonmembers_venn += [len(attends_only_a['Nonmembers'])]
-    nonmembers_venn += [len(attends_only_b['Nonmembers'])]
-    nonmembers_venn += [len(attends_both['Nonmembers'])]
-    # nonmembers_venn = set(nonmembers_venn)
-
-    plotter.venn_diagram(all_venn, 'allvenn.png', title='All')
-    tex_vars['allvenn'] = './.working/allvenn.png'
-
-    plotter.venn_diagram(board_venn, 'boardvenn.png', title='Board Members')
-    tex_vars['boardvenn'] = './.working/boardvenn.png'
-
-    plotter.venn_diagram(volunteers_venn, 'volunteersvenn.png', title='Volunteers')
-    tex_vars['volunteersvenn'] = './.working/volunteersvenn.png'
-
-    plotter.venn_diagram(members_venn, 'membersvenn.png', title='Members')
-    tex_vars['membersvenn'] = './.working/membersvenn.png'
-
-    plotter.venn_diagram(nonmembers_venn, 'nonmembersvenn.png', title='Nonmembers')
-    tex_vars['nonmembersvenn'] = './.working/nonmembersvenn.png'
+    comparison = analyses.compare_attendees(attendance_a, attendance_b)
+    metrics = {
+        'report': 'comparison',
+        'groups': {'a': group_metrics(attendance_a, *events_data_a),
+                   'b': group_metrics(attendance_b, *events_data_b)},
+        'overlap': {overlap: in_order({category: len(emails)
+                                       for category, emails in comparison[overlap].items()})
+                    for overlap in OVERLAPS},
+    }
+    if include_emails:
+        metrics['emails'] = {overlap: sorted_emails(comparison[overlap]) for overlap in OVERLAPS}
+    return metrics
+
+
+def comparison_tex_vars(metrics, work_dir='.'):
+    """Return the tex_vars of a comparison report's metrics, and the chart jobs drawing its images into work_dir."""
+    group_a, group_b = metrics['groups']['a'], metrics['groups']['b']
+    overlap = metrics['overlap']
+
+    tex_vars = {}
+    tex_vars['groupnamea'] = group_a['group']
+    tex_vars['groupnameb'] = group_b['group']
+    measure_vars(tex_vars, group_a, 'a')
+    measure_vars(tex_vars, group_b, 'b')
+
+    charts = []
+    for suffix, category in CATEGORY_VARS:
+        venn = [overlap['a_not_b'][category], overlap['b_not_a'][category], overlap['a_and_b'][category]]
+        venn_file, tex_vars[suffix + 'venn'] = chart_file(work_dir, suffix + 'venn.png')
+        charts.append(('venn_diagram', (venn, venn_file), {'title': VENN_TITLES[category]}))
 
     # optionally, generate email lists
-    if include_emails:
-        tex_vars['emailboardboth'] = ''
-        tex_vars['emailvolunteersboth'] = ''
-        tex_vars['emailmembersboth'] = ''
-        tex_vars['emailnonmembersboth'] = ''
-        tex_vars['emailboardonlya'] = ''
-        tex_vars['emailvolunteersonlya'] = ''
-        tex_vars['emailmembersonlya'] = ''
-        tex_vars['emailnonmembersonlya'] = ''
-        tex_vars['emailboardonlyb'] = ''
-        tex_vars['emailvolunteersonly_b'] = ''
-        tex_vars['emailmembersonly_b'] = ''
-        tex_vars['emailnonmembersonly_b'] = ''
-
-        for email in attends_both['Board']:
-            tex_vars['emailboardboth'] += email + '\n'
-        for email in attends_both['Volunteers']:
-            tex_vars['emailvolunteersboth'] += email + '\n'
-        for email in attends_both['Members']:
-            tex_vars['emailmembersboth'] += email + '\n'
-        for email in attends_both['Nonmembers']:
-            tex_vars['emailnonmembersboth'] += email + '\n'
-        for email in attends_only_a['Board']:
-            tex_vars['emailboardonlya'] += email + '\n'
-        for email in attends_only_a['Volunteers']:
-            tex_vars['emailvolunteersonlya'] += email + '\n'
-        for email in attends_only_a['Members']:
-            tex_vars['emailmembersonlya'] += email + '\n'
-        for email in attends_only_a['Nonmembers']:
-            tex_vars['emailnonmembersonlya'] += email + '\n'
-        for email in attends_only_b['Board']:
-            tex_vars['emailboardonlyb'] += email + '\n'
-        for email in attends_only_b['Volunteers']:
-            tex_vars['emailvolunteersonlyb'] += email + '\n'
-        for email in attends_only_b['Members']:
-            tex_vars['emailmembersonly_b'] += email + '\n'
-        for email in attends_only_b['Nonmembers']:
-            tex_vars['emailnonmembersonlyb'] += email + '\n'
-
-    events_attendance_a = []
-    events_list_a = sorted(events_list_a, key=lambda x: x[1])
-    for event in events_list_a:
-        event_time = datetime.strptime(event[1], '%Y-%m-%dT%H:%M:%S')
-        event_str = event[0] + '\n' + event_time.date().isoformat()
-        events_attendance_a.append((event_str, analyses.count_attendees([event])))
-
-    events_attendance_a = [
-        [e[0]] +
-        [e[1]['Board']] +
-        [e[1]['Volunteers']] +
-        [e[1]['Members']] +
-        [e[1]['Nonmembers']]
-        for e in events_attendance_a
-    ][::-1]  # reverse the resulting list
-
-    events_attendance_b = []
-    events_list_b = sorted(events_list_b, key=lambda x: x[1])
-    for event in events_list_b:
-        event_time = datetime.strptime(event[1], '%Y-%m-%dT%H:%M:%S')
-        event_str = event[0] + '\n' + event_time.date().isoformat()
-        events_attendance_b.append((event_str, analyses.count_attendees([event])))
-
-    events_attendance_b = [
-        [e[0]] +
-        [e[1]['Board']] +
-        [e[1]['Volunteers']] +
-        [e[1]['Members']] +
-        [e[1]['Nonmembers']]
-        for e in events_attendance_b
-    ][::-1]  # reverse the resulting list
-
-    plotter.bar_chart(
-        events_attendance_a, 'attendance_a.png',
-        title='(A): Event Attendance at ' + tex_vars['groupnamea']
-    )
-    plotter.bar_chart(
-        events_attendance_b, 'attendance_b.png',
-        title='(B): Event Attendance at ' + tex_vars['groupnameb']
-    )
-    tex_vars['attendancecharta'] = './.working/attendance_a.png'
-    tex_vars['attendancechartb'] = './.working/attendance_b.png'
-
-    texvar.write_tex_vars(tex_vars)
-    if verbose:
-        subprocess.run('pdflatex -output-directory Reports Templates/comparison.tex', shell=True)
-    else:
-        subprocess.check_output('pdflatex -output-directory Reports Templates/comparison.tex', shell=True)
-    os.remove('./Reports/comparison.aux')
-    os.remove('./Reports/comparison.log')
-    conn.close()
+    if 'emails' in metrics:
+        for overlap_name, var_suffix in (('a_and_b', 'both'), ('a_not_b', 'onlya'), ('b_not_a', 'onlyb')):
+            for suffix, category in CATEGORY_VARS[1:]:
+                tex_vars['email' + suffix + var_suffix] = ''.join(
+                    email + '\n' for email in metrics['emails'][overlap_name][category])
+
+    attendance_a_file, tex_vars['attendancecharta'] = chart_file(work_dir, 'attendance_a.png')
+    attendance_b_file, tex_vars['attendancechartb'] = chart_file(work_dir, 'attendance_b.png')
+    charts.append((
+        'bar_chart', (bar_chart_rows(group_a['events']), attendance_a_file),
+        {'title': '(A): Event Attendance at ' + tex_vars['groupnamea']}
+    ))
+    charts.append((
+        'bar_chart', (bar_chart_rows(group_b['events']), attendance_b_file),
+        {'title': '(B): Event Attendance at ' + tex_vars['groupnameb']}
+    ))
+
+    return tex_vars, [(name, args, dict(kwargs, work_dir=work_dir)) for name, args, kwargs in charts]
+
+
+def comparison_vars(cur, events_data_a, events_data_b, include_emails=False, work_dir='.',
+                    snapshots=None, matrix=None):
+    """Compute the tex_vars of a comparison report, and the chart jobs drawing its images into work_dir.
+
+    Nothing is drawn or written; see comparison_report for the arguments.
+    """
+    metrics = comparison_metrics(cur, events_data_a, events_data_b, include_emails, snapshots, matrix)
+    return comparison_tex_vars(metrics, work_dir)
+
+
+@instrument.traced
+def comparison_report(events_data_a, events_data_b, include_emails=False, verbose=False,
+                      jobname='comparison', output=None, conn=None, snapshots=None, pool=None,
+                      matrix=None, latex_pool=None, output_format='pdf'):
+    """Compare two groups of events.
+
+    events_data_* variables should be 3-tuples of format (names, dates, daterange).
+    see docstring on standard_report for further information on these three variables,
+    and on the remaining arguments. Returns the path of the report.
+    """
+    if conn is None:
+        with db.connection() as conn:  # one pooled read-only connection for the whole report
+            return comparison_report(events_data_a, events_data_b, include_emails, verbose,
+                                     jobname, output, conn, snapshots, pool, matrix, latex_pool,
+                                     output_format)
+
+    check_jobname(jobname)
+    if output is None:
+        output = os.path.join('Reports', jobname + extension(output_format))
+    if output_format != 'pdf':
+        metrics = comparison_metrics(conn.cursor(), events_data_a, events_data_b, include_emails,
+                                     snapshots, matrix)
+        return backends.write(output_format, metrics, output)
+
+    with scratch_dir(jobname) as work_dir:
+        tex_vars, charts = comparison_vars(
+            conn.cursor(), events_data_a, events_data_b, include_emails, work_dir, snapshots, matrix
+        )
+
+        return build_report('comparison', jobname, work_dir, output, tex_vars, charts, verbose,
+                            pool, latex_pool)
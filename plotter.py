@@ -1,71 +1,228 @@
-"""Used by orchestrator to draw graphs."""
-import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib_venn import venn2
-from os import path
+"""Used by orchestrator to draw graphs.
+
+Charts are drawn on standalone Agg figures rather than through pyplot, so that they can be
+rendered concurrently in worker processes; see render_all. Each chart is written to filename
+within work_dir, so concurrent reports can each draw into their own directory. Every chart goes
+through a content-addressed cache, so redrawing a chart from unchanged data just copies the image.
+
+numpy, pandas and matplotlib are only imported once a chart is actually drawn, so importing
+this module (and so orchestrator, and cli) stays cheap.
+"""
+from functools import partial, wraps
+from hashlib import sha256
+from inspect import signature
+import os
+import shutil
+from os import cpu_count, path
+import atomicfile
+import instrument
 
 WORK_DIR = '.working'
+CACHE_DIR = path.join(WORK_DIR, 'cache')
+CACHE_SIZE = 256 * 2 ** 20  # bytes; least recently used images are evicted past this
+STYLE_VERSION = 1  # bump whenever a chart's appearance changes, invalidating the cache
 
 
-def arrival_chart(dataset, filename):
-    """Line plot of the arrival times."""
-    df = pd.DataFrame(dataset)
-    df = df.rename(columns={0: '(Arrival Time - Start Time)'})
-    df = pd.DataFrame(df.groupby('(Arrival Time - Start Time)').size())
-    df = df.rename(columns={0: 'Attendees'})
+def bind(name, args, kwargs):
+    """Return the arguments of a call of chart function name, by parameter, defaults included.
 
-    filename = path.join('.working', filename)
+    However a chart is called, its filename is then arguments['filename'].
+    """
+    arguments = signature(globals()[name]).bind(*args, **kwargs)
+    arguments.apply_defaults()
+    return arguments.arguments
+
+
+def output_file(name, args, kwargs):
+    """Return the path a call of chart function name writes its image to."""
+    arguments = bind(name, args, kwargs)
+    return path.join(arguments['work_dir'], arguments['filename'])
+
+
+def chart_key(name, args, kwargs):
+    """Return the cache key of a chart: a hash of its type, data, title and style."""
+    import numpy as np
+    digest = sha256(repr((STYLE_VERSION, name)).encode())
+    for key, arg in bind(name, args, kwargs).items():
+        if key in ('filename', 'work_dir'):
+            continue  # where the image is written does not change it
+        if isinstance(arg, np.ndarray):
+            digest.update(repr((key, arg.dtype.str, arg.shape)).encode())
+            digest.update(np.ascontiguousarray(arg).tobytes())
+        else:
+            digest.update(repr((key, arg)).encode())
+    return digest.hexdigest()
+
+
+def restore(name, args, kwargs):
+    """Copy a cached chart to its output file, returning whether it was in the cache."""
+    cached_file = path.join(CACHE_DIR, chart_key(name, args, kwargs) + '.png')
+    try:
+        os.utime(cached_file)  # mark as recently used
+        shutil.copyfile(cached_file, output_file(name, args, kwargs))
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def store(name, args, kwargs):
+    """Add a freshly drawn chart to the cache, then evict old charts past CACHE_SIZE."""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    cached_file = path.join(CACHE_DIR, chart_key(name, args, kwargs) + '.png')
+    with atomicfile.replacing(cached_file) as partial_file:  # concurrent readers never see half an image
+        shutil.copyfile(output_file(name, args, kwargs), partial_file)
+    evict(CACHE_DIR, '.png', CACHE_SIZE)
+
+
+def evict(cache_dir, suffix, size):
+    """Remove the least recently used files ending in suffix from cache_dir until they fit in size bytes."""
+    files = []  # (mtime, size, path)
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith(suffix):
+            try:
+                stats = entry.stat()
+            except FileNotFoundError:
+                continue  # already evicted by a concurrent process
+            files.append((stats.st_mtime, stats.st_size, entry.path))
+    total = sum(file_size for mtime, file_size, file_path in files)
+    for mtime, file_size, file_path in sorted(files):
+        if total <= size:
+            break
+        total -= file_size
+        try:
+            os.remove(file_path)
+        except FileNotFoundError:
+            pass  # already evicted by a concurrent process
+
+
+def cached(chart):
+    """Route a chart function of (dataset, filename, ..., work_dir) through the chart cache."""
+    @wraps(chart)
+    def draw(*args, **kwargs):
+        if not restore(chart.__name__, args, kwargs):
+            chart(*args, **kwargs)
+            store(chart.__name__, args, kwargs)
+    return draw
+
+
+def new_figure(**kwargs):
+    """Return a Figure with an Agg canvas attached, and its single Axes."""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    fig = Figure(**kwargs)
+    FigureCanvasAgg(fig)
+    return fig, fig.add_subplot(1, 1, 1)
+
+
+@cached
+def arrival_chart(dataset, filename, work_dir=WORK_DIR):
+    """Line plot of the arrival times.
+
+    dataset is an array (or list) of arrival deltas in minutes, as from analyses.get_arrival_deltas.
+    """
+    import numpy as np
+    import pandas as pd
+    deltas, attendees = np.unique(np.asarray(dataset, dtype=float), return_counts=True)
+    df = pd.DataFrame({'Attendees': attendees},
+                      index=pd.Index(deltas, name='(Arrival Time - Start Time)'))
+
+    filename = path.join(work_dir, filename)
+    fig, ax = new_figure(figsize=(7, 4))
     plot = df.plot(
+        ax=ax,
         colormap='Set2',
-        figsize=(7, 4),
         title="Relative Arrival Times"
     )
     plot.set_xlim(-20, 40)
 
-    fig = plot.get_figure()
-    fig.savefig(filename)
-    plt.close(fig)
+    with instrument.span('savefig'):
+        fig.savefig(filename)
 
 
-def bar_chart(dataset, filename, title="Event Attendance"):
+@cached
+def bar_chart(dataset, filename, title="Event Attendance", work_dir=WORK_DIR):
     """Stacked bar chart of attendance at events in dataset, includes attendee type data."""
+    import pandas as pd
     df = pd.DataFrame(
         dataset, index=[event[0] for event in dataset],
         columns=['Event', 'Board', 'Volunteers', 'Members', 'Nonmembers']
     )
 
-    filename = path.join('.working', filename)
-    plot = df.plot.barh(
+    filename = path.join(work_dir, filename)
+    fig, ax = new_figure(figsize=(16.1, 2 + .45 * len(dataset)))
+    df.plot.barh(
+        ax=ax,
         stacked=True,
         title=title,
-        colormap='Set2',
-        figsize=(16.1, 2 + .45 * len(dataset))
+        colormap='Set2'
     )
 
-    fig = plot.get_figure()
-    fig.savefig(filename)
-    plt.close(fig)
+    with instrument.span('savefig'):
+        fig.savefig(filename)
 
 
-def pie_chart(dataset, filename):
+@cached
+def pie_chart(dataset, filename, work_dir=WORK_DIR):
     """Pie chart of attendance at an event."""
+    import pandas as pd
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
     df = pd.DataFrame(dataset)
-    df = df.drop('All', 0)
+    df = df.drop('All', axis=0)
 
-    filename = path.join('.working', filename)
-    fig = df.plot.pie(subplots=True)[0].get_figure()
-    fig.savefig(filename)
-    plt.close(fig)
+    filename = path.join(work_dir, filename)
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    df.plot.pie(subplots=True, ax=fig.subplots(1, len(df.columns), squeeze=False)[0])
+    with instrument.span('savefig'):
+        fig.savefig(filename)
 
 
-def venn_diagram(dataset, filename, title=''):
+@cached
+def venn_diagram(dataset, filename, title='', work_dir=WORK_DIR):
     """Draw a venn diagram.
 
     dataset should be of form (Ab, aB, AB).
     """
-    venn2(dataset)
-    plt.title(title)
+    from matplotlib_venn import venn2
+    fig, ax = new_figure()
+    venn2(dataset, ax=ax)
+    ax.set_title(title)
+
+    filename = path.join(work_dir, filename)
+    with instrument.span('savefig'):
+        fig.savefig(filename)
+
+
+def render(job, traced=False):
+    """Draw one chart job, a (function name, args, kwargs) triple naming a chart function above.
+
+    Returns the instrument spans of the drawing if traced, for the process that asked for it.
+    """
+    name, args, kwargs = job
+    with instrument.capture(traced) as spans:
+        with instrument.span('plotter.' + name, file=bind(name, args, kwargs)['filename']):
+            globals()[name](*args, **kwargs)
+    return spans
 
-    filename = path.join('.working', filename)
-    plt.savefig(filename)
-    plt.close()
+
+@instrument.traced
+def render_all(jobs, pool=None):
+    """Draw a batch of chart jobs concurrently, returning once all of them are written.
+
+    Cached charts are restored in this process; the rest run on pool if given,
+    otherwise on a process pool created for this batch.
+    """
+    jobs = [job for job in jobs if not restore(*job)]
+    if not jobs:
+        return
+    draw = partial(render, traced=instrument.recording())
+    if pool is not None:
+        for spans in pool.map(draw, jobs):
+            instrument.merge(spans)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max(1, min(len(jobs), cpu_count() or 1))) as pool:
+        for spans in pool.map(draw, jobs):
+            instrument.merge(spans)
@@ -0,0 +1,277 @@
+"""Serve reports from a long-running process that keeps its caches warm.
+
+Selections are POSTed as JSON, in the shape of a batch manifest entry (see batch), to
+
+    /report  which returns the report as a PDF
+    /html    which returns the report as an HTML page, with inline SVG charts
+    /json    which returns the report's metrics as JSON
+    /csv     which returns the report's metrics as CSV
+    /vars    which returns the report's tex_vars as JSON
+
+all but /report without drawing or typesetting anything. For instance
+
+    curl -d '{"names": ["Workshop"], "start": "2017-01-01"}' localhost:8017/report > report.pdf
+
+The server reads through db's pool of read-only connections, shares attendance snapshots
+across requests until the database changes, and reuses the chart cache of plotter.
+Reports run concurrently on a bounded pool of threads, each running at most one pdflatex,
+and draw their charts on a bounded pool of processes.
+"""
+import backends
+import batch
+import db
+import eventselector
+import orchestrator
+import plotter
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+SNAPSHOT_LIMIT = 64  # attendance snapshots kept before starting afresh
+JOBNAME = 'served'  # clients do not name the files reports are typeset into
+MAX_BODY = 2 ** 20  # bytes
+STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+          413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+def validate(entry):
+    """Raise ValueError unless entry is a selection in the shape of a batch manifest entry.
+
+    Requests are checked before any report is generated, so that errors raised while
+    generating one are the server's own.
+    """
+    if not isinstance(entry, dict):
+        raise ValueError('selection must be a JSON object')
+    if not isinstance(entry.get('emails', False), bool):
+        raise ValueError('emails must be true or false')
+    groups = [entry]
+    if 'vs' in entry:
+        if not isinstance(entry['vs'], dict):
+            raise ValueError('vs must be a JSON object')
+        groups.append(entry['vs'])
+
+    for group in groups:
+        for field in ('names', 'dates'):
+            values = group.get(field, [])
+            if not isinstance(values, list) or not all(isinstance(value, str) for value in values):
+                raise ValueError('{} must be a list of strings'.format(field))
+        for field in ('start', 'end'):
+            if not isinstance(group.get(field, ''), (str, type(None))):
+                raise ValueError('{} must be a date'.format(field))
+        eventselector.parse_selection(  # raises ValueError on malformed dates
+            group.get('names', []), group.get('dates', []), group.get('start'), group.get('end')
+        )
+
+
+def report_vars(entry, cur, snapshots):
+    """Return the tex_vars of the report described by a batch manifest entry."""
+    selection = eventselector.parse_selection(
+        entry.get('names', []), entry.get('dates', []), entry.get('start'), entry.get('end')
+    )
+    if 'vs' not in entry:
+        tex_vars, charts = orchestrator.standard_vars(
+            cur, *selection, include_emails=entry.get('emails', False), snapshots=snapshots
+        )
+        return tex_vars
+
+    vs = entry['vs']
+    selection_vs = eventselector.parse_selection(
+        vs.get('names', []), vs.get('dates', []), vs.get('start'), vs.get('end')
+    )
+    tex_vars, charts = orchestrator.comparison_vars(
+        cur, selection, selection_vs, include_emails=entry.get('emails', False),
+        snapshots=snapshots
+    )
+    return tex_vars
+
+
+def report_metrics(entry, cur, snapshots):
+    """Return the metrics of the report described by a batch manifest entry."""
+    selection = eventselector.parse_selection(
+        entry.get('names', []), entry.get('dates', []), entry.get('start'), entry.get('end')
+    )
+    if 'vs' not in entry:
+        return orchestrator.standard_metrics(
+            cur, *selection, include_emails=entry.get('emails', False), snapshots=snapshots
+        )
+
+    vs = entry['vs']
+    selection_vs = eventselector.parse_selection(
+        vs.get('names', []), vs.get('dates', []), vs.get('start'), vs.get('end')
+    )
+    return orchestrator.comparison_metrics(
+        cur, selection, selection_vs, include_emails=entry.get('emails', False),
+        snapshots=snapshots
+    )
+
+
+class Warm(object):
+    """State shared by every request: attendance snapshots and the chart pool."""
+
+    def __init__(self, chart_pool):
+        self.chart_pool = chart_pool
+        self.generation = None  # the data generation self.snapshots were taken at
+        self.snapshots = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a pooled connection and the snapshots of the database's current generation.
+
+        loader bumps the generation stored in meta whenever it changes the data, so every
+        request compares it against the one the snapshots were taken at, and starts afresh
+        if they differ. A request still running on older data keeps, and fills, the
+        snapshots it started with, which no later request sees.
+        """
+        with db.connection() as conn:
+            generation = conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0]
+            with self.lock:
+                if generation != self.generation or len(self.snapshots) > SNAPSHOT_LIMIT:
+                    self.generation = generation
+                    self.snapshots = {}
+                snapshots = self.snapshots
+            yield conn, snapshots
+
+    def report(self, entry):
+        """Generate the report described by entry, returning the contents of its PDF."""
+        os.makedirs(plotter.WORK_DIR, exist_ok=True)
+        handle, output = tempfile.mkstemp(suffix='.pdf', dir=plotter.WORK_DIR)
+        os.close(handle)
+        try:
+            with self.connection() as (conn, snapshots):
+                batch.run_entry(dict(entry, name=JOBNAME, format='pdf'),
+                                snapshots, self.chart_pool, output=output, conn=conn)
+            with open(output, 'rb') as pdf:
+                return pdf.read()
+        finally:
+            os.remove(output)
+
+    def document(self, output_format, entry):
+        """Return the report described by entry in output_format, one of backends.BACKENDS."""
+        with self.connection() as (conn, snapshots):
+            metrics = report_metrics(entry, conn.cursor(), snapshots)
+        return backends.render(output_format, metrics).encode()
+
+    def vars(self, entry):
+        """Return the tex_vars of the report described by entry, encoded as JSON."""
+        with self.connection() as (conn, snapshots):
+            return json.dumps(report_vars(entry, conn.cursor(), snapshots)).encode()
+
+
+async def respond(writer, status, body, content_type='text/plain; charset=utf-8'):
+    """Write an HTTP response and close the connection."""
+    writer.write(('HTTP/1.1 {} {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n' +
+                  'Connection: close\r\n\r\n').format(
+                      status, STATUS[status], content_type, len(body)).encode() + body)
+    await writer.drain()
+    writer.close()
+
+
+def handler(warm, report_pool):
+    """Return the connection callback of a server running requests on report_pool."""
+    routes = {'/report': (warm.report, 'application/pdf'),
+              '/vars': (warm.vars, 'application/json')}
+    for output_format, (extension, render, content_type) in backends.BACKENDS.items():
+        routes['/' + output_format] = (partial(warm.document, output_format), content_type)
+
+    async def handle(reader, writer):
+        try:
+            method, target, _ = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+        except (ValueError, ConnectionError):
+            writer.close()
+            return
+
+        if target not in routes:
+            return await respond(writer, 404, b'unknown path\n')
+        if method != 'POST':
+            return await respond(writer, 405, b'POST a JSON selection\n')
+        try:
+            length = int(headers.get('content-length') or 0)
+        except ValueError:
+            return await respond(writer, 400, b'invalid Content-Length\n')
+        if length < 0:
+            return await respond(writer, 400, b'invalid Content-Length\n')
+        if length > MAX_BODY:
+            return await respond(writer, 413, b'selection too large\n')
+
+        try:
+            body = await reader.readexactly(length)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        try:
+            entry = json.loads(body.decode() or '{}')
+            validate(entry)
+        except ValueError as error:  # including malformed JSON and UTF-8
+            return await respond(writer, 400, '{}\n'.format(error).encode())
+
+        generate, content_type = routes[target]
+        try:
+            body = await asyncio.get_running_loop().run_in_executor(report_pool, generate, entry)
+        except Exception as error:
+            return await respond(writer, 500, '{}\n'.format(error).encode())
+        await respond(writer, 200, body, content_type)
+
+    return handle
+
+
+async def serve(host, port, socket_path, workers, chart_workers):
+    """Run the server until cancelled."""
+    # chart processes start as they are needed, so they must not be forked from this one,
+    # or they would hold on to the sockets of the clients connected at the time
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+    with ProcessPoolExecutor(chart_workers, mp_context=context) as chart_pool, \
+            ThreadPoolExecutor(workers) as report_pool:
+        warm = Warm(chart_pool)
+        handle = handler(warm, report_pool)
+        if socket_path:
+            server = await asyncio.start_unix_server(handle, socket_path)
+        else:
+            server = await asyncio.start_server(handle, host, port)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            report_pool.shutdown()
+            db.pool().close()
+
+
+def main():
+    """Execute when program is directly invoked."""
+    parser = argparse.ArgumentParser(description='Org Analytics report server.')
+    parser.add_argument('--host', default='127.0.0.1', help='Address to listen on.')
+    parser.add_argument('--port', '-p', type=int, default=8017, help='Port to listen on.')
+    parser.add_argument('--socket', metavar='PATH', help='Listen on a Unix socket instead.')
+    parser.add_argument(
+        '--workers', '-w', type=int, default=4,
+        help='Number of reports to generate concurrently.'
+    )
+    parser.add_argument(
+        '--chart-workers', type=int, default=None,
+        help='Number of chart rendering processes, one per core by default.'
+    )
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.socket, args.workers, args.chart_workers))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
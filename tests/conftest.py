@@ -0,0 +1,57 @@
+"""Fixtures shared by the tests: small generated databases, and exports written to order.
+
+The modules under test, and benchmarks/generate.py, are imported from the repository root.
+"""
+from os.path import abspath, dirname, join
+import sys
+
+import pytest
+
+ROOT = dirname(dirname(abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, join(ROOT, 'benchmarks'))
+
+import db  # noqa: E402
+import generate  # noqa: E402
+import loader  # noqa: E402
+
+
+@pytest.fixture
+def data_dir(tmp_path, monkeypatch):
+    """An empty directory of exports, and a fresh database in place of loader.DB."""
+    monkeypatch.setattr(loader, 'DB', str(tmp_path / 'test.db'))
+    path = tmp_path / 'data'
+    path.mkdir()
+    yield str(path)
+    db.pool(readonly=True).close()
+    db.pool(readonly=False).close()
+
+
+@pytest.fixture
+def database(data_dir):
+    """Generate exports into data_dir and load them, yielding data_dir and a read-only connection."""
+    generate.generate(data_dir, events=20, attendees=30, students=60, seed=1)
+    loader.main(data_dir, workers=1)
+    conn = db.connect(readonly=True)
+    yield data_dir, conn
+    conn.close()
+
+
+@pytest.fixture
+def write_export(data_dir):
+    """Return a function writing an export of one event into data_dir.
+
+    It takes the export's file name, the event's name and start time, and a dictionary
+    mapping the emails of its attendees, who all check in on time, to their group lists;
+    it returns the export's path.
+    """
+    def write(filename, name, start, attendees):
+        time = start.strftime(generate.TIME_FORMAT)
+        rows = [list(generate.LABELS)]
+        for email in attendees:
+            rows.append([time, name, 'Last', 'First', email, '', '', '', '', time, '',
+                         attendees[email]])
+        path = join(data_dir, filename)
+        generate.write_xlsx(path, rows)
+        return path
+    return write
@@ -0,0 +1,56 @@
+"""Attendee counts of selections some categories, or every category, are missing from."""
+from datetime import datetime
+
+import pytest
+
+import analyses
+import backends
+import db
+import eventselector
+import loader
+import matrix
+import orchestrator
+
+START = datetime(2016, 1, 15, 18, 0)
+
+
+@pytest.fixture
+def cur(data_dir, write_export):
+    """A cursor over a database holding one event, attended by a single nonmember."""
+    write_export('Social Participation (0).xlsx', 'Social', START, {'a@gatech.edu': ''})
+    loader.main(data_dir, workers=1)
+    conn = db.connect(readonly=True)
+    yield conn.cursor()
+    conn.close()
+
+
+def snapshots(cur, selection):
+    """Return the Attendance, memoized and matrix snapshots of a selection."""
+    cur.execute(*eventselector.build_query(*selection))
+    events_list = cur.fetchall()
+    return (analyses.Attendance(events_list, cur), analyses.select(cur, *selection)[1],
+            matrix.AttendanceMatrix(cur).view(events_list))
+
+
+def test_averages_of_missing_categories_are_zero(cur):
+    selection = eventselector.parse_selection(dates=['2016-01-15'])
+    for attendance in snapshots(cur, selection):
+        metrics = orchestrator.group_metrics(attendance, *selection)
+        assert metrics['average_events'] == {'Nonmembers': 1, 'Members': 0, 'Volunteers': 0,
+                                             'Board': 0, 'All': 1}
+        assert metrics['average_attendance'] == {'Nonmembers': 1, 'Members': 0,
+                                                 'Volunteers': 0, 'Board': 0, 'All': 1}
+
+
+def test_averages_of_empty_selections_are_zero(cur):
+    selection = eventselector.parse_selection(names=['Workshop'])
+    for attendance in snapshots(cur, selection):
+        metrics = orchestrator.group_metrics(attendance, *selection)
+        assert metrics['average_events'] == dict.fromkeys(backends.CATEGORIES, 0)
+        assert metrics['average_attendance'] == dict.fromkeys(backends.CATEGORIES, 0)
+
+
+def test_backends_render_missing_categories(cur):
+    metrics = orchestrator.standard_metrics(cur, dates=[START], include_emails=True)
+    for output_format in backends.BACKENDS:
+        assert backends.render(output_format, metrics)
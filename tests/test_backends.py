@@ -0,0 +1,98 @@
+"""Rendering report metrics as CSV and HTML."""
+import csv
+import io
+
+import pytest
+
+import backends
+
+
+def counts(nonmembers, members, volunteers, board):
+    """Return counts per category, in the order of backends.CATEGORIES."""
+    return {'Nonmembers': nonmembers, 'Members': members, 'Volunteers': volunteers,
+            'Board': board, 'All': nonmembers + members + volunteers + board}
+
+
+def group(name):
+    """Return the metrics of a group of two events, as orchestrator.group_metrics does."""
+    return {
+        'group': name,
+        'selection': {'names': ['Social'], 'dates': [], 'date_range': []},
+        'events': [{'name': 'Social', 'time': '2016-01-01T18:00:00', 'counts': counts(2, 1, 0, 1)},
+                   {'name': 'Social', 'time': '2016-01-08T18:00:00', 'counts': counts(1, 1, 0, 0)}],
+        'distinct': counts(2, 1, 0, 1),
+        'total': counts(3, 2, 0, 1),
+        'average_attendance': counts(1.5, 1, 0, .5),
+        'average_events': counts(1.5, 2, 0, 1),
+        'arrivals': [[-2.0, 1], [0.0, 3], [5.0, 2]],
+    }
+
+
+def standard():
+    """Return the metrics of a standard report, emails included."""
+    return dict(group("`Social' <events>"), report='standard', emails={
+        'Nonmembers': ['a@gatech.edu', 'b@gatech.edu'], 'Members': ['c@gatech.edu'],
+        'Volunteers': [], 'Board': ['d@gatech.edu'],
+        'All': ['a@gatech.edu', 'b@gatech.edu', 'c@gatech.edu', 'd@gatech.edu']})
+
+
+def comparison():
+    """Return the metrics of a comparison report, without emails."""
+    return {'report': 'comparison', 'groups': {'a': group('A events'), 'b': group('B events')},
+            'overlap': {'a_and_b': counts(1, 1, 0, 0), 'a_not_b': counts(1, 0, 0, 1),
+                        'b_not_a': counts(0, 0, 1, 0)}}
+
+
+def test_csv_rows_of_standard_reports():
+    rows = list(backends.csv_rows(standard()))
+    assert rows[0] == ('group', '', "`Social' <events>", '', '')
+    assert ('total', '', '', 'Nonmembers', 3) in rows
+    assert ('average_events', '', '', 'Members', 2) in rows
+    assert ('event', '', 'Social 2016-01-08T18:00:00', 'All', 2) in rows
+    assert [row for row in rows if row[0] == 'arrivals'] == [
+        ('arrivals', '', -2.0, 'All', 1), ('arrivals', '', 0.0, 'All', 3),
+        ('arrivals', '', 5.0, 'All', 2)]
+    # emails are listed once each, under their own category rather than under All too
+    assert [row for row in rows if row[0] == 'email'] == [
+        ('email', '', 'a@gatech.edu', 'Nonmembers', ''),
+        ('email', '', 'b@gatech.edu', 'Nonmembers', ''),
+        ('email', '', 'c@gatech.edu', 'Members', ''),
+        ('email', '', 'd@gatech.edu', 'Board', '')]
+    measures = [measure for measure, label, number_format in backends.MEASURES]
+    assert len([row for row in rows if row[0] in measures]) == len(measures) * len(backends.CATEGORIES)
+
+
+def test_csv_rows_of_comparison_reports():
+    rows = list(backends.csv_rows(comparison()))
+    assert [row for row in rows if row[0] == 'group'] == [
+        ('group', 'a', 'A events', '', ''), ('group', 'b', 'B events', '', '')]
+    assert ('overlap', 'b_not_a', '', 'Volunteers', 1) in rows
+    assert ('overlap', 'a_and_b', '', 'All', 2) in rows
+    assert not [row for row in rows if row[0] == 'email']
+
+
+def test_render_csv_has_a_header_and_a_row_per_number():
+    rows = list(csv.reader(io.StringIO(backends.render_csv(standard()))))
+    assert rows[0] == ['section', 'group', 'item', 'category', 'value']
+    assert rows[1:] == [[str(value) for value in row] for row in backends.csv_rows(standard())]
+
+
+def test_render_html_of_standard_reports():
+    page = backends.render_html(standard())
+    assert page.startswith('<!DOCTYPE html>')
+    assert '<h1>‘Social’ &lt;events&gt;</h1>' in page
+    assert page.count('<svg') == 2  # event attendance and arrival times
+    assert '<td>Members</td><td>2</td><td>1</td><td>1.000</td><td>2.000</td>' in page
+    assert '<summary>Nonmembers emails (2)</summary><pre>a@gatech.edu\nb@gatech.edu</pre>' in page
+
+
+def test_render_html_of_comparison_reports():
+    page = backends.render_html(comparison())
+    assert '<title>COMPARISON: (A): A events &amp; (B): B events</title>' in page
+    assert page.count('<svg') == 2 + len(backends.CATEGORIES)  # a Venn diagram per category
+    assert '<details>' not in page
+
+
+def test_render_rejects_unknown_formats():
+    with pytest.raises(ValueError):
+        backends.render('pdf', standard())
@@ -0,0 +1,114 @@
+"""Check that every way of reading attendance agrees with the records themselves.
+
+A small database is generated with benchmarks/generate.py, then the metrics of a few
+selections are computed from rollups (analyses.Attendance), memoized snapshots
+(analyses.select) and an attendance matrix, and compared with counts taken straight from
+records and students. The comparison is repeated after ingests that change an attendee's
+group flags, which must refresh the rollups and invalidate memoized snapshots.
+
+    python -m pytest tests
+"""
+from datetime import timedelta
+
+import analyses
+import eventselector
+import generate
+import loader
+import matrix
+import orchestrator
+
+SELECTIONS = (
+    eventselector.parse_selection(start='2015-08-01', end='2015-12-31'),
+    eventselector.parse_selection(names=['Workshop', 'Social', 'Tech Talk']),
+)
+MEASURES = ('events', 'distinct', 'total', 'average_attendance', 'average_events', 'arrivals')
+EXTRA_EXPORT = 'Workshop Participation (extra).xlsx'
+EXTRA_TIME = generate.FIRST_EVENT + timedelta(days=40)
+
+
+def direct_metrics(cur, events_list):
+    """Return the measures of group_metrics for events_list, and its distinct attendees, from records alone."""
+    events = [tuple(event) for event in events_list]
+    event_counts = {event: dict.fromkeys(analyses.CATEGORIES, 0) for event in events}
+    students = {}
+    deltas = {}
+    for event in events:
+        cur.execute('SELECT r.student_email, s.is_member, s.is_volunteer, s.is_board, ' +
+                    '(r.checkin_epoch - e.epoch) / 60.0 ' +
+                    'FROM records r JOIN students s ON s.email = r.student_email ' +
+                    'JOIN events e ON e.name = r.event_name AND e.time = r.event_time ' +
+                    'WHERE r.event_name = ? AND r.event_time = ?', event)
+        for email, is_member, is_volunteer, is_board, delta in cur.fetchall():
+            category = analyses.classify(is_member, is_volunteer, is_board)
+            students[email] = category
+            event_counts[event]['All'] += 1
+            event_counts[event][category] += 1
+            if delta is not None:
+                deltas[delta] = deltas.get(delta, 0) + 1
+
+    distinct = analyses.tally(students.values())
+    total = analyses.total_counts(event_counts.values())
+    return {
+        'events': [{'name': name, 'time': time, 'counts': orchestrator.in_order(event_counts[name, time])}
+                   for name, time in sorted(events, key=lambda event: event[1])],
+        'distinct': orchestrator.in_order(distinct),
+        'total': orchestrator.in_order(total),
+        'average_attendance': orchestrator.in_order(
+            {category: total[category] / len(events) for category in total}),
+        'average_events': orchestrator.in_order(
+            {category: total[category] / distinct[category] for category in total}),
+        'arrivals': [[delta, deltas[delta]] for delta in sorted(deltas)],
+    }, sorted(students)
+
+
+def measures(attendance, selection):
+    """Return the measures of group_metrics of attendance, and its distinct attendees."""
+    metrics = orchestrator.group_metrics(attendance, *selection)
+    return {measure: metrics[measure] for measure in MEASURES}, sorted(attendance.emails()['All'])
+
+
+def check_paths(conn):
+    """Assert that each path reading attendance agrees with direct_metrics on every selection."""
+    cur = conn.cursor()
+    attendance_matrix = matrix.AttendanceMatrix(cur)
+    for selection in SELECTIONS:
+        cur.execute(*eventselector.build_query(*selection))
+        events_list = cur.fetchall()
+        expected = direct_metrics(cur, events_list)
+
+        assert measures(analyses.Attendance(events_list, cur), selection) == expected
+        for _ in range(2):  # computed and stored, then read back from the memo table
+            memo_events, attendance = analyses.select(cur, *selection)
+            assert sorted(memo_events) == sorted(events_list)
+            assert measures(attendance, selection) == expected
+        assert measures(attendance_matrix.view(events_list), selection) == expected
+
+
+def flags(conn, email):
+    """Return the group flags of the student with email."""
+    return conn.execute('SELECT is_member, is_volunteer, is_board FROM students WHERE email = ?',
+                        [email]).fetchone()
+
+
+def test_paths_agree(database):
+    data_dir, conn = database
+    check_paths(conn)
+
+
+def test_paths_agree_after_regrouping(database, write_export):
+    data_dir, conn = database
+    # the most regular attendee, whose new groups change the counts of many events
+    email = conn.execute('SELECT student_email FROM records GROUP BY student_email ' +
+                         'ORDER BY count(*) DESC, student_email LIMIT 1').fetchone()[0]
+    check_paths(conn)
+
+    write_export(EXTRA_EXPORT, 'Workshop', EXTRA_TIME, {email: 'CSO Board, General Members'})
+    loader.main(data_dir, workers=1)
+    assert flags(conn, email) == (1, 0, 1)
+    check_paths(conn)
+
+    # re-ingested, as it changed
+    write_export(EXTRA_EXPORT, 'Workshop', EXTRA_TIME, {email: 'CSO Pillar Volunteers'})
+    loader.main(data_dir, workers=1)
+    assert flags(conn, email) == (0, 1, 0)
+    check_paths(conn)
@@ -0,0 +1,52 @@
+"""Selections compiled to WHERE clauses over events: names, dates and date ranges."""
+from datetime import datetime
+import sqlite3
+
+import pytest
+
+import eventselector
+
+EVENTS = [('Social', '2016-01-01T00:00:00'), ('Social', '2016-01-01T23:59:00'),
+          ('Workshop', '2016-01-02T18:00:00'), ('Social', '2016-01-03T18:00:00'),
+          ('Workshop', '2016-01-05T18:00:00'), ('Social', '2016-01-06T00:00:00')]
+
+
+def day(number):
+    """Return midnight of a day of January 2016."""
+    return datetime(2016, 1, number)
+
+
+def select(names=[], dates=[], date_range=()):
+    """Return the events of EVENTS a selection selects, in order."""
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE events(name TEXT, time TEXT, PRIMARY KEY(name, time))')
+    conn.executemany('INSERT INTO events VALUES (?,?)', EVENTS)
+    query, params = eventselector.build_query(names, dates, date_range)
+    return sorted(conn.execute(query, params), key=lambda event: event[1])
+
+
+def test_consecutive_dates_share_a_range():
+    selection = eventselector.compile_selection(dates=[day(3), day(1), day(2), day(5), day(2)])
+    assert selection.where.count('time >= ?') == 2
+    assert selection.params == ['2016-01-01', '2016-01-04', '2016-01-05', '2016-01-06']
+    assert select(dates=[day(3), day(1), day(2), day(5), day(2)]) == EVENTS[:5]
+
+
+def test_date_range_includes_whole_end_day():
+    selection = eventselector.compile_selection(date_range=(day(1), day(5)))
+    assert selection.params == ['2016-01-01', '2016-01-06']
+    assert select(date_range=(day(1), day(5))) == EVENTS[:5]
+    assert select(date_range=(day(2), day(2))) == EVENTS[2:3]
+
+
+def test_names_and_dates_combine():
+    assert select(names=['Social'], date_range=(day(1), day(3))) == [EVENTS[0], EVENTS[1], EVENTS[3]]
+    assert select(names=['Social', 'Workshop'], dates=[day(2), day(6)]) == [EVENTS[2], EVENTS[5]]
+    assert select() == EVENTS
+
+
+def test_malformed_selections_raise():
+    with pytest.raises(TypeError):
+        eventselector.compile_selection(dates=['2016-01-01'])
+    with pytest.raises(ValueError):
+        eventselector.compile_selection(date_range=(day(1),))
@@ -0,0 +1,110 @@
+"""Ingest through loader.main: skipping unchanged exports, decoding them on worker processes,
+and resolving events described by several exports.
+"""
+from datetime import datetime
+import multiprocessing
+import os
+
+import pytest
+
+import db
+import loader
+
+START = datetime(2016, 1, 15, 18, 0)
+LATER = datetime(2016, 1, 22, 18, 0)
+# the export owning an event is the first, in path order, of those describing it
+FIRST, SECOND, THIRD = ('Social Participation ({}).xlsx'.format(i) for i in range(3))
+
+
+def test_unchanged_exports_start_no_workers(database, monkeypatch):
+    data_dir, conn = database
+
+    def refuse(*args, **kwargs):
+        raise AssertionError('no exports changed, so none need decoding')
+    monkeypatch.setattr(multiprocessing, 'Manager', refuse)
+    loader.main(data_dir)
+
+
+def attendees(conn, name, start):
+    """Return the sorted emails recorded at an event, or None if it is not in the database."""
+    event = [name, start.isoformat()]
+    if conn.execute('SELECT 1 FROM events WHERE name = ? AND time = ?', event).fetchone() is None:
+        return None
+    return [row[0] for row in conn.execute(
+        'SELECT student_email FROM records WHERE event_name = ? AND event_time = ? ' +
+        'ORDER BY student_email', event)]
+
+
+def rollup(conn, name, start):
+    """Return the number of nonmembers at an event according to its rollup, or None if it has none."""
+    row = conn.execute('SELECT nonmembers FROM rollup WHERE event_name = ? AND event_time = ?',
+                       [name, start.isoformat()]).fetchone()
+    return row and row[0]
+
+
+@pytest.fixture(params=[1, 2], ids=['writer', 'pooled'])
+def load(request, data_dir):
+    """Return a function loading data_dir, on one process or on two decoding workers.
+
+    It returns a read-only connection to the database, which is closed after the test.
+    """
+    connections = []
+
+    def load():
+        loader.main(data_dir, request.param)
+        connections.append(db.connect(readonly=True))
+        return connections[-1]
+    yield load
+    for conn in connections:
+        conn.close()
+
+
+def test_duplicate_exports_are_skipped(load, write_export):
+    write_export(FIRST, 'Social', START, {'a@gatech.edu': ''})
+    write_export(SECOND, 'Social', START, {'b@gatech.edu': ''})
+    conn = load()
+    assert attendees(conn, 'Social', START) == ['a@gatech.edu']
+
+    # a duplicate of an event loaded before, in a file sorted after its owner
+    write_export(THIRD, 'Social', START, {'c@gatech.edu': ''})
+    assert attendees(load(), 'Social', START) == ['a@gatech.edu']
+    assert conn.execute('SELECT count(*) FROM manifest').fetchone()[0] == 3
+
+
+def test_removed_owners_hand_their_events_on(load, write_export):
+    first = write_export(FIRST, 'Social', START, {'a@gatech.edu': ''})
+    second = write_export(SECOND, 'Social', START, {'b@gatech.edu': ''})
+    load()
+
+    os.remove(first)
+    conn = load()
+    assert attendees(conn, 'Social', START) == ['b@gatech.edu']
+    assert rollup(conn, 'Social', START) == 1
+
+    os.remove(second)  # the last file of an event gone, its records are kept
+    conn = load()
+    assert attendees(conn, 'Social', START) == ['b@gatech.edu']
+    assert conn.execute('SELECT count(*) FROM manifest').fetchone()[0] == 0
+
+
+def test_exports_moving_to_another_event_hand_theirs_on(load, write_export):
+    write_export(FIRST, 'Social', START, {'a@gatech.edu': ''})
+    write_export(SECOND, 'Social', START, {'b@gatech.edu': ''})
+    load()
+
+    write_export(FIRST, 'Social', LATER, {'c@gatech.edu': ''})
+    conn = load()
+    assert attendees(conn, 'Social', START) == ['b@gatech.edu']
+    assert attendees(conn, 'Social', LATER) == ['c@gatech.edu']
+    assert rollup(conn, 'Social', START) == 1
+
+
+def test_exports_moving_to_another_event_delete_theirs(load, write_export):
+    write_export(FIRST, 'Social', START, {'a@gatech.edu': ''})
+    load()
+
+    write_export(FIRST, 'Social', LATER, {'c@gatech.edu': ''})
+    conn = load()
+    assert attendees(conn, 'Social', START) is None
+    assert rollup(conn, 'Social', START) is None
+    assert attendees(conn, 'Social', LATER) == ['c@gatech.edu']
@@ -0,0 +1,67 @@
+"""Mailing lists streamed from SQL: single selections, and the overlaps of two."""
+from datetime import datetime
+import os
+
+import pytest
+
+import analyses
+import db
+import eventselector
+import loader
+import mailinglist
+
+SOCIAL = eventselector.parse_selection(names=['Social'])
+WORKSHOP = eventselector.parse_selection(names=['Workshop'])
+
+
+@pytest.fixture
+def exports(data_dir, write_export):
+    """Load two Socials and a Workshop, some of whose attendees came to both."""
+    write_export('Social Participation (0).xlsx', 'Social', datetime(2016, 1, 15, 18, 0),
+                 {'a@gatech.edu': '', 'b@gatech.edu': 'General Members',
+                  'c@gatech.edu': 'CSO Board, General Members'})
+    write_export('Social Participation (1).xlsx', 'Social', datetime(2016, 1, 22, 18, 0),
+                 {'a@gatech.edu': ''})
+    write_export('Workshop Participation (0).xlsx', 'Workshop', datetime(2016, 1, 20, 18, 0),
+                 {'b@gatech.edu': 'General Members', 'd@gatech.edu': 'CSO Pillar Volunteers'})
+    loader.main(data_dir, workers=1)
+    return data_dir
+
+
+def test_selection_emails(exports):
+    assert list(mailinglist.selection_emails(SOCIAL)) == [
+        ('Board', 'c@gatech.edu'), ('Members', 'b@gatech.edu'), ('Nonmembers', 'a@gatech.edu')]
+    assert sorted(mailinglist.selection_emails(SOCIAL, distinct=False)) == [
+        ('Board', 'c@gatech.edu'), ('Members', 'b@gatech.edu'),
+        ('Nonmembers', 'a@gatech.edu'), ('Nonmembers', 'a@gatech.edu')]
+
+
+def test_overlap_queries_intersect_and_except(exports):
+    overlaps = {overlap: list(mailinglist.stream(*mailinglist.overlap_query(overlap, SOCIAL, WORKSHOP)))
+                for overlap, operator in mailinglist.OVERLAPS}
+    assert overlaps == {'a_and_b': [('Members', 'b@gatech.edu')],
+                        'a_not_b': [('Board', 'c@gatech.edu'), ('Nonmembers', 'a@gatech.edu')],
+                        'b_not_a': [('Volunteers', 'd@gatech.edu')]}
+
+    # the same partition as analyses.compare_attendees
+    with db.connection() as conn:
+        comparison = analyses.compare_attendees(analyses.select(conn.cursor(), *SOCIAL)[1],
+                                                analyses.select(conn.cursor(), *WORKSHOP)[1])
+    for overlap, rows in overlaps.items():
+        assert sorted(comparison[overlap]['All']) == sorted(email for category, email in rows)
+
+
+def test_export_to_files(exports, tmp_path):
+    lists = tmp_path / 'lists'
+    assert mailinglist.export(str(lists), SOCIAL, WORKSHOP) == 4
+    assert sorted(os.listdir(str(lists))) == sorted(
+        '{}-{}.txt'.format(overlap, category.lower())
+        for overlap, operator in mailinglist.OVERLAPS for category in mailinglist.CATEGORIES)
+    assert (lists / 'a_not_b-nonmembers.txt').read_text() == 'a@gatech.edu\n'
+    assert (lists / 'b_not_a-members.txt').read_text() == ''
+
+
+def test_export_to_stdout(exports, capsys):
+    assert mailinglist.export('-', WORKSHOP) == 2
+    assert capsys.readouterr().out.splitlines() == [
+        'category,email', 'Members,b@gatech.edu', 'Volunteers,d@gatech.edu']
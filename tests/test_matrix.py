@@ -0,0 +1,44 @@
+"""Loading the attendance matrix while ingest writes to the database."""
+import db
+import matrix
+
+
+class IngestingCursor(object):
+    """A cursor that lets ingest commit a new attendee of a new event after its first SELECT."""
+
+    def __init__(self, cur):
+        self.cur = cur
+        self.connection = cur.connection
+        self.selected = False
+
+    def execute(self, query, params=()):
+        self.cur.execute(query, params)
+        if query.startswith('SELECT') and not self.selected:
+            self.selected = True
+            writer = db.connect()
+            with writer:
+                writer.execute("INSERT INTO students VALUES ('new@gatech.edu', 'New', 1, 0, 0)")
+                writer.execute("INSERT INTO events(name, time) VALUES ('Late', '2020-01-01T18:00:00')")
+                writer.execute("INSERT INTO records VALUES ('Late', '2020-01-01T18:00:00', " +
+                               "'new@gatech.edu', NULL)")
+            writer.close()
+        return self
+
+    def fetchall(self):
+        return self.cur.fetchall()
+
+
+def test_load_reads_one_snapshot(database):
+    data_dir, conn = database
+    events = conn.execute('SELECT count(*) FROM events').fetchone()[0]
+    records = conn.execute('SELECT count(*) FROM records').fetchone()[0]
+
+    attendance_matrix = matrix.AttendanceMatrix(IngestingCursor(conn.cursor()))
+    assert len(attendance_matrix.events) == events
+    assert len(attendance_matrix.indices) == records
+    assert not conn.in_transaction
+
+    # the next load sees the new attendee
+    attendance_matrix = matrix.AttendanceMatrix(conn.cursor())
+    assert 'new@gatech.edu' in attendance_matrix.student_ids
+    assert len(attendance_matrix.events) == events + 1
@@ -0,0 +1,32 @@
+"""Eviction from the chart and document caches."""
+import os
+
+import plotter
+
+
+def fill(cache_dir, names):
+    """Write a 10 byte file for each of names into cache_dir, least recently used first."""
+    for age, name in enumerate(reversed(names)):
+        path = os.path.join(str(cache_dir), name)
+        with open(path, 'wb') as cached_file:
+            cached_file.write(b'0123456789')
+        os.utime(path, (1e9 - age, 1e9 - age))
+
+
+def test_evict_least_recently_used(tmp_path):
+    fill(tmp_path, ['a.png', 'b.png', 'c.png', 'd.pdf'])
+    plotter.evict(str(tmp_path), '.png', 20)
+    assert sorted(os.listdir(str(tmp_path))) == ['b.png', 'c.png', 'd.pdf']
+
+
+def test_evict_files_evicted_meanwhile(tmp_path, monkeypatch):
+    fill(tmp_path, ['a.png', 'b.png', 'c.png'])
+    scandir = os.scandir
+
+    def evicting_scandir(path):
+        entries = list(scandir(path))
+        os.remove(os.path.join(path, 'b.png'))  # by another process, once listed
+        return iter(entries)
+    monkeypatch.setattr(os, 'scandir', evicting_scandir)
+    plotter.evict(str(tmp_path), '.png', 10)
+    assert os.listdir(str(tmp_path)) == ['c.png']
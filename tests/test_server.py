@@ -0,0 +1,49 @@
+"""The report server's validation of requests, and its handling of reports that fail."""
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+import pytest
+
+import plotter
+import server
+from conftest import ROOT
+
+
+@pytest.mark.parametrize('entry', [
+    {},
+    {'names': ['Workshop', 'Social'], 'emails': True},
+    {'dates': ['2016-01-15'], 'start': None},
+    {'start': '2016-01-01', 'end': '2016-02-01', 'vs': {'names': ['Social']}},
+])
+def test_valid_selections(entry):
+    server.validate(entry)
+
+
+@pytest.mark.parametrize('entry', [
+    [],
+    'Workshop',
+    {'names': 'Workshop'},
+    {'names': ['Workshop', 3]},
+    {'dates': ['15 January 2016']},
+    {'start': 20160101},
+    {'start': '2016-01-01', 'end': '2016-02-30'},
+    {'emails': 'yes'},
+    {'vs': ['Social']},
+    {'vs': {'dates': ['2016-13-01']}},
+])
+def test_invalid_selections(entry):
+    with pytest.raises(ValueError):
+        server.validate(entry)
+
+
+def test_failed_reports_leave_no_scratch_files(database, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    os.symlink(os.path.join(ROOT, 'Templates'), 'Templates')
+    (tmp_path / 'bin').mkdir()
+    monkeypatch.setenv('PATH', str(tmp_path / 'bin'))  # no pdflatex to run
+
+    with ThreadPoolExecutor(2) as chart_pool:
+        with pytest.raises(OSError):
+            server.Warm(chart_pool).report({'names': ['Workshop']})
+    assert not [entry for entry in os.listdir(plotter.WORK_DIR)
+                if entry.startswith(server.JOBNAME)]
@@ -1,12 +1,14 @@
 """Handle generation and management of latex variable files."""
+import instrument
 
 
-def write_tex_vars(tex_vars):
-    """Convert a dictionary to a tex variable file."""
+@instrument.traced
+def write_tex_vars(tex_vars, filename):
+    """Convert a dictionary to a tex variable file, normally vars.tex in a report's scratch directory."""
     if not isinstance(tex_vars, dict):
         raise TypeError('tex_vars must be a dictionary')
 
-    var_file = open('.working/vars.tex', 'w')
+    var_file = open(filename, 'w')
 
     for key in tex_vars:
         if isinstance(tex_vars[key], str) and tex_vars[key][-4:] == '.png':
@@ -0,0 +1,151 @@
+"""Typeset report templates with pdflatex, doing as little LaTeX work as possible.
+
+Each template's preamble, everything before its \\endofdump, is compiled once into a format
+file with mylatexformat, which every later run loads instead of reading the packages again.
+Formats live in FORMAT_DIR and are rebuilt whenever their template changes; if building one
+fails, say because mylatexformat is not installed, runs read the whole template as before.
+
+Finished PDFs are kept in a content-addressed cache, keyed by the template, the report's
+tex_vars and the cache keys of its charts (see plotter.chart_key), so a report identical to
+one built before is copied from the cache without drawing a chart or running pdflatex.
+"""
+from hashlib import sha256
+from os import path
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import atomicfile
+import plotter
+
+TEMPLATE_DIR = 'Templates'
+FORMAT_DIR = path.join(plotter.WORK_DIR, 'formats')
+DOCUMENT_DIR = path.join(plotter.WORK_DIR, 'documents')
+DOCUMENT_CACHE_SIZE = 256 * 2 ** 20  # bytes; least recently used PDFs are evicted past this
+
+FORMATS = {}  # template file digest: format name, or None if it could not be built
+LOCK = threading.Lock()
+
+
+def template_file(template):
+    """Return the path of a template's source."""
+    return path.join(TEMPLATE_DIR, template + '.tex')
+
+
+def template_digest(template):
+    """Return a hash of a template's source."""
+    with open(template_file(template), 'rb') as source:
+        return sha256(source.read()).hexdigest()
+
+
+def format_name(template):
+    """Return the name of the precompiled format of a template, building it first if needed.
+
+    Returns None if the format cannot be built.
+    """
+    digest = template_digest(template)
+    with LOCK:  # concurrent reports of a template wait for one build
+        if digest not in FORMATS:
+            FORMATS[digest] = build_format(template, template + '-' + digest[:16])
+        return FORMATS[digest]
+
+
+def build_format(template, name):
+    """Dump a template's preamble into FORMAT_DIR/name.fmt, returning name, or None on failure."""
+    if path.exists(path.join(FORMAT_DIR, name + '.fmt')):
+        return name
+    os.makedirs(FORMAT_DIR, exist_ok=True)
+    build_dir = tempfile.mkdtemp(dir=FORMAT_DIR)
+    try:
+        subprocess.run(['pdflatex', '-ini', '-interaction=nonstopmode', '-jobname', name,
+                        '-output-directory', build_dir, '&pdflatex', 'mylatexformat.ltx',
+                        template_file(template)],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        os.replace(path.join(build_dir, name + '.fmt'), path.join(FORMAT_DIR, name + '.fmt'))
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    finally:
+        shutil.rmtree(build_dir)
+
+    for entry in os.scandir(FORMAT_DIR):  # formats of earlier versions of the template
+        if entry.name.startswith(template + '-') and entry.name != name + '.fmt':
+            os.remove(entry.path)
+    return name
+
+
+def prepare(templates):
+    """Build the formats of templates ahead of time, so that no report waits for one."""
+    for template in templates:
+        format_name(template)
+
+
+def pdflatex(template, jobname, work_dir, fmt, verbose):
+    """Run pdflatex over a template, loading the format fmt unless it is None."""
+    command = ['pdflatex', '-interaction=nonstopmode', '-jobname', jobname,
+               '-output-directory', work_dir]
+    if fmt is not None:
+        command.append('-fmt=' + fmt)
+    command.append('\\def\\workdir{./%s}\\input{%s}' % (work_dir, template_file(template)))
+    # the empty entry after the separator keeps TeX's own formats on the search path
+    env = dict(os.environ, TEXFORMATS=path.abspath(FORMAT_DIR) + os.pathsep)
+    return subprocess.run(command, env=env, stdout=None if verbose else subprocess.PIPE)
+
+
+def run_pdflatex(template, jobname, work_dir, verbose=False):
+    """Typeset a template over the vars.tex in work_dir, returning the path of the PDF.
+
+    Output is shown if verbose, and captured otherwise; either way a failed run raises
+    CalledProcessError, so its PDF is never cached or used. A failed run is retried
+    without the template's format, which is dropped if that run succeeds.
+    """
+    fmt = format_name(template)
+    result = pdflatex(template, jobname, work_dir, fmt, verbose)
+    if result.returncode and fmt is not None:
+        result = pdflatex(template, jobname, work_dir, None, verbose)
+        if not result.returncode:
+            with LOCK:
+                FORMATS[template_digest(template)] = None
+            try:
+                os.remove(path.join(FORMAT_DIR, fmt + '.fmt'))
+            except FileNotFoundError:
+                pass  # already dropped by a concurrent run
+    if result.returncode:
+        raise subprocess.CalledProcessError(result.returncode, result.args, result.stdout)
+    return path.join(work_dir, jobname + '.pdf')
+
+
+def document_key(template, tex_vars, charts):
+    """Return the cache key of a report: a hash of its template, tex_vars and charts.
+
+    Image paths differ between runs, so images are keyed by what is drawn on them instead.
+    """
+    digest = sha256(template_digest(template).encode())
+    digest.update(repr(sorted((key, value) for key, value in tex_vars.items()
+                              if not (isinstance(value, str) and value.endswith('.png')))).encode())
+    charts = sorted((plotter.bind(*chart)['filename'], chart) for chart in charts)
+    for filename, (name, args, kwargs) in charts:
+        digest.update(repr((filename, plotter.chart_key(name, args, kwargs))).encode())
+    return digest.hexdigest()
+
+
+def restore(key, output):
+    """Copy a cached PDF to output, returning whether it was in the cache."""
+    cached_file = path.join(DOCUMENT_DIR, key + '.pdf')
+    try:
+        os.utime(cached_file)  # mark as recently used
+        os.makedirs(path.dirname(output) or '.', exist_ok=True)
+        with atomicfile.replacing(output) as partial_file:  # readers never see half a PDF
+            shutil.copyfile(cached_file, partial_file)
+    except FileNotFoundError:
+        return False
+    return True
+
+
+def store(key, pdf):
+    """Add a freshly typeset PDF to the cache, then evict old PDFs past DOCUMENT_CACHE_SIZE."""
+    os.makedirs(DOCUMENT_DIR, exist_ok=True)
+    cached_file = path.join(DOCUMENT_DIR, key + '.pdf')
+    with atomicfile.replacing(cached_file) as partial_file:
+        shutil.copyfile(pdf, partial_file)
+    plotter.evict(DOCUMENT_DIR, '.pdf', DOCUMENT_CACHE_SIZE)